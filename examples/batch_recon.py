@@ -0,0 +1,221 @@
+# ----------------------------------------------------------------------------------------
+# batch_recon
+# ----------------------------------------------------------------------------------------
+# Batch reconstruction of many scans with a pool of worker processes. The scans are either
+# taken from an inbox directory (which can optionally be watched for new scans) or from a
+# manifest file. Every worker process imports precon once and then reconstructs one scan
+# after the other with one of the example scripts (recipes). The scans are scheduled through
+# a priority queue and the throughput as well as the latency of every job is reported.
+#
+# Args:
+#        inbox (optional)        : The directory which contains the scans to be reconstructed
+#        manifest (optional)     : A manifest file with one job per line (json, see below)
+#        recipe (optional)       : The default recipe for all scans (see RECIPES)
+#        recipe-args (optional)  : Additional arguments passed to the recipe of every inbox scan (e.g. the refscan)
+#        workers (optional)      : The number of worker processes
+#        threads (optional)      : The number of threads of every worker (default: the cores are shared equally)
+#        watch (optional)        : When given, the inbox is watched for new scans until Ctrl+C is pressed
+#        poll-interval (optional): The interval in seconds in which the inbox is checked for new scans
+#        output_path (optional)  : The output path. The results of every scan are stored in a subfolder
+#
+# Every line of the manifest is a json object with the following keys:
+#
+#   file     (required): The path to the raw, lab or sin file
+#   recipe   (optional): The recipe (default: --recipe)
+#   priority (optional): Jobs with a lower number are reconstructed first (default: 0)
+#   args     (optional): A list of additional arguments passed to the recipe (e.g. the refscan)
+#
+#   {"file": "/data/scan_3.raw", "recipe": "sense", "priority": 1, "args": ["/data/refscan.raw"]}
+#
+# The recipes which need a SENSE reference scan (see REFSCAN_RECIPES) can only be used for
+# an inbox when the refscan is given with --recipe-args (the same for all inbox scans).
+#
+# Example:
+#
+#   python batch_recon.py /data/inbox --recipe sense_sin --workers 8 --watch
+#   python batch_recon.py /data/inbox --recipe sense --recipe-args /data/refscan.raw
+
+import argparse
+import heapq
+import itertools
+import json
+import os
+import runpy
+import shlex
+import statistics
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+from thread_limits import process_budget, set_num_threads
+
+# the recipes and the file extension of their input
+RECIPES = {
+    'simple': ('simple_recon.py', '.raw'),
+    'simple_sin': ('simple_recon_sin.py', '.sin'),
+    'sense': ('sense_recon.py', '.raw'),
+    'sense_sin': ('sense_recon_sin.py', '.sin'),
+    'array_compression': ('array_compression.py', '.raw'),
+    'cardiac_retro': ('cardiac_retro_recon.py', '.raw'),
+    'epi': ('epi_recon.py', '.raw'),
+    'flow': ('flow_recon.py', '.raw'),
+    'flow_sin': ('flow_recon_sin.py', '.sin'),
+    'spectro_sv': ('spectro_sv_recon.py', '.raw'),
+}
+
+# the recipes which need the path of the SENSE reference scan as argument
+REFSCAN_RECIPES = ('sense', 'array_compression', 'flow')
+
+EXAMPLES_FOLDER = Path(__file__).resolve().parent
+
+
+def init_worker(threads):
+    # import precon (and its dependencies) once per worker process
+    import precon  # noqa: F401
+    import scipy.io  # noqa: F401
+
+    # limit the threads of numpy, the FFT and torch such that the workers do not oversubscribe the cores
+    set_num_threads(threads)
+
+
+def run_job(recipe, file, extra_args, output_path):
+    script = EXAMPLES_FOLDER / RECIPES[recipe][0]
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    start = time.perf_counter()
+    argv = sys.argv
+    sys.argv = [str(script), str(file), *extra_args, '--output-path', str(output_path)]
+    try:
+        runpy.run_path(str(script), run_name='__main__')
+    except SystemExit as e:
+        # e.g. raised by argparse when the arguments of the recipe are invalid
+        if e.code:
+            raise RuntimeError(f'{script.name} exited with code {e.code}') from None
+    finally:
+        sys.argv = argv
+    return time.perf_counter() - start
+
+
+class Job:
+    def __init__(self, file, recipe, priority=0, args=()):
+        if recipe not in RECIPES:
+            raise ValueError(f'unknown recipe: {recipe} (must be one of {", ".join(RECIPES)})')
+        self.file = Path(file)
+        self.recipe = recipe
+        self.priority = priority
+        self.args = list(args)
+        self.queued = time.perf_counter()
+
+
+def read_manifest(manifest, default_recipe):
+    jobs = []
+    with open(manifest, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            jobs.append(Job(entry['file'], entry.get('recipe', default_recipe), entry.get('priority', 0), entry.get('args', [])))
+    return jobs
+
+
+def scan_inbox(inbox, recipe, seen, sizes, recipe_args=()):
+    # a file is only queued when its size has not changed since the last poll (i.e. it is not being copied anymore)
+    extension = RECIPES[recipe][1]
+    jobs = []
+    for file in sorted(inbox.glob(f'*{extension}'), key=os.path.getmtime):
+        if file in seen:
+            continue
+        size = file.stat().st_size
+        if sizes.get(file) == size:
+            seen.add(file)
+            jobs.append(Job(file, recipe, args=recipe_args))
+        sizes[file] = size
+    return jobs
+
+
+def print_summary(latencies, run_times, failed, elapsed):
+    print(f'\n{len(latencies)} jobs finished, {failed} failed in {elapsed:.1f}s')
+    if latencies:
+        print(f'throughput: {60 * len(latencies) / elapsed:.2f} jobs/min')
+        print(f'latency   : mean {statistics.mean(latencies):.1f}s, max {max(latencies):.1f}s')
+        print(f'run time  : mean {statistics.mean(run_times):.1f}s, max {max(run_times):.1f}s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='batch recon')
+    parser.add_argument('inbox', nargs='?', default=None, help='the directory with the scans to be reconstructed')
+    parser.add_argument('--manifest', default=None, help='a manifest file with one json job per line')
+    parser.add_argument('--recipe', default='simple', choices=list(RECIPES), help='the default recipe')
+    parser.add_argument('--recipe-args', default='', help='additional arguments of the recipe of every inbox scan')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='the number of worker processes')
+    parser.add_argument('--threads', type=int, default=None, help='the number of threads of every worker')
+    parser.add_argument('--watch', action='store_true', help='watch the inbox for new scans')
+    parser.add_argument('--poll-interval', type=float, default=2, help='the poll interval of the inbox in seconds')
+    parser.add_argument('--output-path', default='./', help='path where the output is saved')
+    args = parser.parse_args()
+
+    if not args.inbox and not args.manifest:
+        parser.error('either an inbox or a manifest must be given')
+    recipe_args = shlex.split(args.recipe_args)
+    if args.inbox and args.recipe in REFSCAN_RECIPES and not recipe_args:
+        parser.error(f'the recipe {args.recipe} needs a refscan, which must be given with --recipe-args for an inbox')
+
+    # the priority queue (the counter keeps the order of jobs with the same priority)
+    queue = []
+    counter = itertools.count()
+
+    def enqueue(jobs):
+        for job in jobs:
+            heapq.heappush(queue, (job.priority, next(counter), job))
+
+    if args.manifest:
+        enqueue(read_manifest(args.manifest, args.recipe))
+
+    inbox = Path(args.inbox) if args.inbox else None
+    seen = set()
+    sizes = dict()
+    if inbox:
+        # poll twice such that the sizes of the files can be compared
+        scan_inbox(inbox, args.recipe, seen, sizes, recipe_args)
+        time.sleep(args.poll_interval)
+        enqueue(scan_inbox(inbox, args.recipe, seen, sizes, recipe_args))
+
+    latencies = []
+    run_times = []
+    failed = 0
+    start = time.perf_counter()
+    running = dict()
+    threads = args.threads or process_budget(args.workers)
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(threads,)) as pool:
+        try:
+            while queue or running or args.watch:
+                # submit jobs until all workers are busy
+                while queue and len(running) < args.workers:
+                    _, _, job = heapq.heappop(queue)
+                    output_path = Path(args.output_path) / job.file.stem
+                    future = pool.submit(run_job, job.recipe, job.file, job.args, output_path)
+                    running[future] = job
+
+                if not running:
+                    time.sleep(args.poll_interval)
+                done, _ = wait(running, timeout=args.poll_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    latency = time.perf_counter() - job.queued
+                    try:
+                        run_time = future.result()
+                    except Exception as e:
+                        failed += 1
+                        print(f'[failed] {job.file.name} ({job.recipe}): {e}')
+                        continue
+                    latencies.append(latency)
+                    run_times.append(run_time)
+                    print(f'[done] {job.file.name} ({job.recipe}): run time {run_time:.1f}s, latency {latency:.1f}s')
+
+                if inbox and args.watch:
+                    enqueue(scan_inbox(inbox, args.recipe, seen, sizes, recipe_args))
+        except KeyboardInterrupt:
+            print('interrupted, waiting for the running jobs to finish')
+
+    print_summary(latencies, run_times, failed, time.perf_counter() - start)
@@ -0,0 +1,116 @@
+# ----------------------------------------------------------------------------------------
+# benchmark_reader
+# ----------------------------------------------------------------------------------------
+# Benchmarks the precon reader on one or more rawfiles (or zip files which contain a
+# rawfile, e.g. the example data in the data directory). The following variants are timed:
+#
+#   fused      : the oversampling removal is performed by the reader (default of pr.read)
+#   separate   : the data is read without oversampling removal which is then removed in a
+#                second pass over the data (FFT, crop and inverse FFT along the readout)
+#   threads    : like fused but all mixes, stacks and dynamics are read in parallel threads
+#
+# Args:
+#        rawfiles (required): The paths to the Philips rawfiles (or zip files)
+#        repeat (optional)  : The number of repetitions of every variant
+#        threads (optional) : The number of threads used in the threads variant
+#
+# Example:
+#
+#   python benchmark_reader.py ../data/ffe_2d.zip ../data/epi.zip
+
+import argparse
+import os
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+import precon as pr
+
+
+def remove_oversampling(data, factor, axis=0):
+    # the readout oversampling removal as a separate pass over the data
+    n = data.shape[axis]
+    n_out = int(round(n / factor))
+    spectrum = np.fft.fftshift(np.fft.fft(data, axis=axis), axes=axis)
+    start = (n - n_out) // 2
+    spectrum = np.take(spectrum, np.arange(start, start + n_out), axis=axis)
+    return np.fft.ifft(np.fft.ifftshift(spectrum, axes=axis), axis=axis).astype(data.dtype, copy=False)
+
+
+def selections(pars):
+    parameter2read = pr.Parameter2Read(pars.labels)
+    return [(mix, stack, dyn) for mix in parameter2read.mix for stack in parameter2read.stack for dyn in parameter2read.dyn]
+
+
+def read(pars, mix, stack, dyn, **kwargs):
+    parameter2read = pr.Parameter2Read(pars.labels)
+    parameter2read.mix = mix
+    parameter2read.stack = stack
+    parameter2read.dyn = dyn
+    with open(pars.rawfile, 'rb') as raw:
+        data, _ = pr.read(raw, parameter2read, pars.labels, pars.coil_info, **kwargs)
+    return data
+
+
+def fused(pars):
+    return sum(read(pars, *s).nbytes for s in selections(pars))
+
+
+def separate(pars):
+    nbytes = 0
+    for mix, stack, dyn in selections(pars):
+        data = read(pars, mix, stack, dyn, oversampling_removal=False)
+        xovs = pars.get_oversampling(enc=0, mix=mix)
+        nbytes += remove_oversampling(data, xovs, axis=0).nbytes
+    return nbytes
+
+
+def threaded(pars, threads):
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return sum(data.nbytes for data in pool.map(lambda s: read(pars, *s), selections(pars)))
+
+
+def find_rawfile(path, temp_dir):
+    # extracts zip files into a temporary directory
+    path = Path(path)
+    if path.suffix != '.zip':
+        return path
+    with zipfile.ZipFile(path, 'r') as zip_ref:
+        zip_ref.extractall(temp_dir)
+    rawfiles = list(Path(temp_dir).glob('*.raw'))
+    if not rawfiles:
+        raise FileNotFoundError(f'no rawfile found in {path}')
+    return rawfiles[0]
+
+
+parser = argparse.ArgumentParser(description='reader benchmark')
+parser.add_argument('rawfiles', nargs='+', help='paths to the raw or zip files')
+parser.add_argument('--repeat', type=int, default=5, help='the number of repetitions')
+parser.add_argument('--threads', type=int, default=os.cpu_count(), help='the number of threads')
+args = parser.parse_args()
+
+variants = {
+    'fused': fused,
+    'separate': separate,
+    'threads': lambda pars: threaded(pars, args.threads),
+}
+
+for path in args.rawfiles:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        rawfile = find_rawfile(path, temp_dir)
+        pars = pr.Parameter(rawfile)
+        pars.performance_logging = False
+        print(f'{Path(path).name} ({rawfile.stat().st_size / 1e6:.1f} MB)')
+
+        for name, variant in variants.items():
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                nbytes = variant(pars)
+                times.append(time.perf_counter() - start)
+            print(f'  {name:<10} min {min(times) * 1e3:8.1f} ms, mean {np.mean(times) * 1e3:8.1f} ms, '
+                  f'output {nbytes / 1e6:.1f} MB')
@@ -0,0 +1,65 @@
+# ----------------------------------------------------------------------------------------
+# benchmark_sensitivities
+# ----------------------------------------------------------------------------------------
+# Compares the time and the peak memory of the sensitivity calculation at the full target
+# resolution with the estimation on a coarse grid and subsequent upsampling (see the
+# --coarse-factor argument of calculate_sensititivites.py). Every variant runs in its own
+# process such that the peak memory can be measured. Additionally, the deviation of the
+# upsampled sensitivity maps from the full resolution maps is reported.
+#
+# Args:
+#        refscan (required)       : The path to the Philips SENSE reference scan
+#        target_scan (required)   : The path to the SENSE scan (target scan)
+#        coarse-factors (optional): The coarse factors which are compared to the full resolution
+#
+# Note: the peak memory is measured with os.wait4 which is only available on Linux and Mac.
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from scipy.io import loadmat
+
+SCRIPT = Path(__file__).resolve().parent / 'calculate_sensititivites.py'
+
+
+def run(refscan, target_scan, output_path, coarse_factor=None):
+    cmd = [sys.executable, str(SCRIPT), refscan, target_scan, '--match-target-size', '--output-path', str(output_path)]
+    if coarse_factor:
+        cmd += ['--coarse-factor', str(coarse_factor)]
+
+    start = time.perf_counter()
+    process = subprocess.Popen(cmd)
+    _, status, rusage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    if not os.WIFEXITED(status) or os.WEXITSTATUS(status) != 0:
+        raise RuntimeError(f'{" ".join(cmd)} failed')
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on Mac
+    peak = rusage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    return elapsed, peak, loadmat(output_path / 'sense.mat')['sensitivity']
+
+
+parser = argparse.ArgumentParser(description='sensitivity benchmark')
+parser.add_argument('refscan', help='path to the raw or lab file of the sense refscan')
+parser.add_argument('target_scan', help='path to the raw or lab file of the target scan')
+parser.add_argument('--coarse-factors', nargs='+', type=float, default=[2, 4], help='the coarse factors')
+args = parser.parse_args()
+
+with tempfile.TemporaryDirectory() as temp_dir:
+    output_path = Path(temp_dir)
+    elapsed, peak, reference = run(args.refscan, args.target_scan, output_path)
+    print(f'{"full":<10} time {elapsed:6.1f}s, peak memory {peak / 1e6:8.1f} MB')
+
+    for factor in args.coarse_factors:
+        elapsed, peak, sensitivity = run(args.refscan, args.target_scan, output_path, coarse_factor=factor)
+        # the deviation is only evaluated where the full resolution maps are defined
+        mask = np.abs(reference) > 0
+        error = np.linalg.norm(sensitivity[mask] - reference[mask]) / np.linalg.norm(reference[mask])
+        print(f'{f"coarse {factor:g}":<10} time {elapsed:6.1f}s, peak memory {peak / 1e6:8.1f} MB, '
+              f'relative deviation {error:.3f}')
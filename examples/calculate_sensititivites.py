@@ -10,12 +10,18 @@
 #        match-target-size (optional): When given the sensitivity maps have the same size as the target images
 #        fov (optional)              : A user defined field-of-view for the sensitivity maps
 #        output_size (optional)      : A user defined output size for the sensitivity maps
+#        coarse-factor (optional)    : When given the sensitivity maps are estimated on a grid which is coarser by this
+#                                      factor and then upsampled to the output size. Since the coil sensitivities are
+#                                      smooth this saves time and memory (see coarse_sensitivities.py and
+#                                      benchmark_sensitivities.py)
 
 import argparse
 from pathlib import Path
 
 from scipy.io import savemat
 
+import precon as pr
+from coarse_sensitivities import check_size, get_coarse_size, upsample
 from precon import calculate_sensitivities
 
 parser = argparse.ArgumentParser(description='normal recon')
@@ -25,9 +31,30 @@ parser.add_argument('--output-path', default='./', help='path where the output i
 parser.add_argument('--match-target-size', action='store_true', help='if given then the size of the sensitivities matches the one of the target data')
 parser.add_argument('--fov', nargs="+", type=float, default=None, help='the FOV of the sensitivity maps')
 parser.add_argument('--output_size', nargs="+", type=int, default=None, help='the putput size of the sensitivities')
+parser.add_argument('--coarse-factor', type=float, default=None, help='estimate the sensitivities on a grid which is coarser by this factor')
 args = parser.parse_args()
 
-s = calculate_sensitivities(Path(args.refscan), Path(args.target_scan), stack=0, mix=0, match_target_size=args.match_target_size, fov=args.fov, output_size=args.output_size)
+if not args.coarse_factor:
+    s = calculate_sensitivities(Path(args.refscan), Path(args.target_scan), stack=0, mix=0, match_target_size=args.match_target_size, fov=args.fov, output_size=args.output_size)
+    mdic = {'qbc': s.bodycoil, 'coil': s.surfacecoil, 'sensitivity': s.sensitivity, 'psi': s.psi}
+else:
+    # the final size of the sensitivity maps
+    if args.output_size:
+        output_size = args.output_size
+    elif args.match_target_size:
+        target_pars = pr.Parameter(Path(args.target_scan))
+        output_size = target_pars.get_recon_resolution(mix=0, xovs=False, yovs=True, zovs=True, folded=False)
+    else:
+        raise RuntimeError('the coarse factor requires either --output_size or --match-target-size')
+    output_size = [int(x) for x in output_size[:3]]
 
-mdic = {'qbc': s.bodycoil, 'coil': s.surfacecoil, 'sensitivity': s.sensitivity, 'psi': s.psi}
-savemat(Path(args.output_path) / 'sense.mat', mdic)
\ No newline at end of file
+    # estimate the sensitivities on the coarse grid (dimensions with a size of 1 are not reduced)
+    coarse_size = get_coarse_size(output_size, args.coarse_factor)
+    s = calculate_sensitivities(Path(args.refscan), Path(args.target_scan), stack=0, mix=0, match_target_size=args.match_target_size, fov=args.fov, output_size=coarse_size)
+    check_size(s, coarse_size)
+
+    # upsample the maps to the final size (the noise covariance matrix psi does not depend on the grid)
+    mdic = {'qbc': upsample(s.bodycoil, output_size), 'coil': upsample(s.surfacecoil, output_size),
+            'sensitivity': upsample(s.sensitivity, output_size), 'psi': s.psi}
+
+savemat(Path(args.output_path) / 'sense.mat', mdic)
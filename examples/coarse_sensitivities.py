@@ -0,0 +1,59 @@
+# ----------------------------------------------------------------------------------------
+# coarse_sensitivities
+# ----------------------------------------------------------------------------------------
+# Estimates the sensitivity maps on a grid which is coarser than the target images and
+# upsamples them to the target size. Since the coil sensitivities are smooth this saves
+# time and memory (see benchmark_sensitivities.py). Used by calculate_sensititivites.py and
+# sense_recon.py (--coarse-factor).
+#
+# Usage:
+#
+#   from coarse_sensitivities import reformat_refscan_coarse
+#
+#   qbc, coil = pr.reconstruct_refscan(ref_pars)
+#   sens = reformat_refscan_coarse(qbc, coil, ref_pars, pars, stack=stack, mix=mix, coarse_factor=2)
+#
+# The noise covariance matrix (psi) does not depend on the grid and is not changed.
+
+from math import ceil
+
+import numpy as np
+from scipy.ndimage import zoom
+
+import precon as pr
+from sensitivity_maps import MAP_ATTRIBUTES, map_sensitivity
+
+
+def get_coarse_size(output_size, coarse_factor):
+    # the size of the coarse grid (dimensions with a size of 1 are not reduced)
+    return [max(1, ceil(int(x) / coarse_factor)) for x in output_size[:3]]
+
+
+def check_size(sens, size):
+    # the sensitivities must have been calculated on the requested grid (e.g. match_target_size must not override it)
+    actual = list(sens.sensitivity.shape[:3])
+    if actual != list(size):
+        raise RuntimeError(f'the sensitivities were calculated with the size {actual} instead of {list(size)}')
+
+
+def upsample(data, output_size):
+    # linear interpolation of the spatial dimensions (the real and imaginary part are interpolated separately)
+    factors = [output_size[i] / data.shape[i] if i < 3 else 1 for i in range(data.ndim)]
+    if np.iscomplexobj(data):
+        return zoom(data.real, factors, order=1, mode='nearest', grid_mode=True) + \
+            1j * zoom(data.imag, factors, order=1, mode='nearest', grid_mode=True)
+    return zoom(data, factors, order=1, mode='nearest', grid_mode=True)
+
+
+def upsample_sensitivity(sens, output_size):
+    # returns a copy of the sensitivity container with the maps upsampled to the output size
+    return map_sensitivity(sens, lambda value: upsample(value, output_size), MAP_ATTRIBUTES)
+
+
+def reformat_refscan_coarse(qbc, coil, ref_pars, pars, stack, mix, coarse_factor):
+    """Same as pr.reformat_refscan with match_target_size=True, but the maps are estimated on a coarse grid."""
+    output_size = [int(x) for x in pars.get_recon_resolution(mix=mix, xovs=False, yovs=True, zovs=True, folded=False)[:3]]
+    coarse_size = get_coarse_size(output_size, coarse_factor)
+    sens = pr.reformat_refscan(qbc, coil, ref_pars, pars, stack=stack, mix=mix, match_target_size=True, output_size=coarse_size)
+    check_size(sens, coarse_size)
+    return upsample_sensitivity(sens, output_size)
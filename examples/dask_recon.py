@@ -0,0 +1,160 @@
+# ----------------------------------------------------------------------------------------
+# dask_recon
+# ----------------------------------------------------------------------------------------
+# A simple cartesian reconstruction (see simple_recon.py) which is built as a lazy dask task
+# graph. The dynamics of every mix and stack are split into chunks and every chunk is read,
+# sorted and reconstructed by its own task, which writes the images into a temporary numpy
+# file. Nothing is read before the graph is computed, and the tasks are run in parallel by
+# the dask scheduler (threads or processes). Afterwards, the chunks are copied one by one
+# into an HDF5 file, hence neither the k-space nor the images of the whole scan are in
+# memory at the same time.
+#
+# Args:
+#        rawfile (required)             : The path to the Philips rawfile to be reconstructed
+#        output_path (optional)         : The output path where the results (data.h5) are stored
+#        dynamics-per-chunk (optional)  : The number of dynamics which are reconstructed in one task
+#        scheduler (optional)           : The dask scheduler ('threads', 'processes' or 'synchronous')
+#        workers (optional)             : The number of parallel workers
+#
+# The dynamics are independent along the whole pipeline (the geometry correction is applied
+# per location, therefore the locations are never split into different chunks). The tasks
+# only return the path of their temporary file, since the size of the images is not known
+# before the data is sorted. The HDF5 file is only written by the main process (h5py
+# objects cannot be shared with worker processes).
+#
+# Requires: dask, h5py
+
+import argparse
+import tempfile
+from pathlib import Path
+
+import dask
+import h5py
+import numpy as np
+
+import precon as pr
+
+
+def read_chunk(pars, mix, stack, dynamics):
+    # every task uses its own Parameter2Read since the tasks run concurrently
+    parameter2read = pr.Parameter2Read(pars.labels)
+    parameter2read.mix = mix
+    parameter2read.stack = stack
+    parameter2read.dyn = dynamics
+
+    # read data
+    with open(pars.rawfile, 'rb') as raw:
+        data, labels = pr.read(raw, parameter2read, pars.labels, pars.coil_info)
+
+    # sort and zero fill data (create k-space)
+    cur_recon_resolution = pars.get_recon_resolution(mix=mix, xovs=False, yovs=True, zovs=True)
+    return pr.sort(data, labels, output_size=cur_recon_resolution)
+
+
+def reconstruct_chunk(pars, mix, stack, chunk):
+    data, labels = chunk
+
+    # FFT
+    data = pr.k2i(data, axis=(0, 1, 2))
+
+    # shift data in image space
+    yshift = pars.get_shift(enc=1, mix=mix, stack=stack)
+    zshift = pars.get_shift(enc=2, mix=mix, stack=stack)
+    if yshift:
+        data = np.roll(data, yshift, axis=1)
+    if zshift:
+        data = np.roll(data, zshift, axis=2)
+
+    # partial fourier reconstruction
+    kx_range = pars.get_range(enc=0, mix=mix, stack=stack, ovs=False)
+    ky_range = pars.get_range(enc=1, mix=mix, stack=stack)
+    kz_range = pars.get_range(enc=2, mix=mix, stack=stack)
+    if pr.is_partial_fourier(kx_range) or pr.is_partial_fourier(ky_range) or pr.is_partial_fourier(kz_range):
+        data = pr.homodyne(data, kx_range, ky_range, kz_range)
+
+    # combine coils with a sum-of squares combination
+    data = pr.sos(data, axis=3)
+
+    # perform geometry correction
+    r, gys, gxc, gz = pars.get_geo_corr_pars()
+    locations = pr.utils.get_unique(labels, 'loca')
+    MPS_to_XYZ = pars.get_transformation_matrix(loca=locations, mix=mix, target=pr.Enums.XYZ)
+    voxel_sizes = pars.get_voxel_sizes(mix=mix)
+    data = pr.geo_corr(data, MPS_to_XYZ, r, gys, gxc, gz, voxel_sizes=voxel_sizes)
+
+    # remove the oversampling
+    yovs = pars.get_oversampling(enc=1, mix=mix)
+    zovs = pars.get_oversampling(enc=2, mix=mix)
+    data = pr.crop(data, axis=(1, 2), factor=(yovs, zovs), where='symmetric')
+
+    # transform the images into the radiological convention
+    data = pr.format(data, pars.get_in_plane_transformation(mix=mix, stack=stack))
+
+    # make the image square
+    res = max(data.shape[0], data.shape[1])
+    return pr.zeropad(data, (res, res), axis=(0, 1))
+
+
+def reconstruct_to_file(pars, mix, stack, dynamics, filename):
+    # a task which reconstructs one chunk and stores the images in a numpy file (only the path is returned to the
+    # scheduler, so the images are never sent between the processes)
+    data = reconstruct_chunk(pars, mix, stack, read_chunk(pars, mix, stack, dynamics))
+    np.save(filename, data)
+    return filename
+
+
+def build_tasks(pars, mix, stack, dynamics, dynamics_per_chunk, tmp_path):
+    # one lazy task per chunk of dynamics
+    tasks = []
+    for i in range(0, len(dynamics), dynamics_per_chunk):
+        filename = Path(tmp_path) / f'data_{mix}_{stack}_{i}.npy'
+        tasks.append(dask.delayed(reconstruct_to_file)(pars, mix, stack, dynamics[i:i + dynamics_per_chunk], filename))
+    return tasks
+
+
+def write_dataset(h5, name, filenames):
+    # copies the chunks (concatenated along the dynamics) into the hdf5 file, only one chunk is loaded at a time
+    chunks = [np.load(filename, mmap_mode='r') for filename in filenames]
+    shape = list(chunks[0].shape)
+    shape[pr.Enums.DYN_DIM] = sum(chunk.shape[pr.Enums.DYN_DIM] for chunk in chunks)
+    dataset = h5.create_dataset(name, shape=tuple(shape), dtype=chunks[0].dtype)
+
+    start = 0
+    for chunk in chunks:
+        index = [slice(None)] * len(shape)
+        index[pr.Enums.DYN_DIM] = slice(start, start + chunk.shape[pr.Enums.DYN_DIM])
+        dataset[tuple(index)] = chunk
+        start += chunk.shape[pr.Enums.DYN_DIM]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='dask recon')
+    parser.add_argument('rawfile', help='path to the raw or lab file')
+    parser.add_argument('--output-path', default='./', help='path where the output is saved')
+    parser.add_argument('--dynamics-per-chunk', type=int, default=1, help='the number of dynamics per task')
+    parser.add_argument('--scheduler', default='threads', choices=['threads', 'processes', 'synchronous'], help='the dask scheduler')
+    parser.add_argument('--workers', type=int, default=None, help='the number of parallel workers')
+    args = parser.parse_args()
+
+    # read parameter
+    pars = pr.Parameter(Path(args.rawfile))
+
+    # define what to read
+    parameter2read = pr.Parameter2Read(pars.labels)
+    dynamics = list(parameter2read.dyn)
+
+    with tempfile.TemporaryDirectory(dir=args.output_path) as tmp_path:
+        # build the lazy tasks of every mix and stack (nothing is read yet)
+        tasks = dict()
+        for mix in parameter2read.mix:
+            for stack in parameter2read.stack:
+                tasks[f'/data_{mix}_{stack}'] = build_tasks(pars, mix, stack, dynamics, args.dynamics_per_chunk, tmp_path)
+
+        # reconstruct all chunks in parallel
+        with dask.config.set(scheduler=args.scheduler, num_workers=args.workers):
+            filenames, = dask.compute(tasks)
+
+        # copy the chunks into the hdf5 file
+        with h5py.File(Path(args.output_path) / 'data.h5', 'w') as h5:
+            for name, chunk_filenames in filenames.items():
+                write_dataset(h5, name, chunk_filenames)
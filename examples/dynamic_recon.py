@@ -0,0 +1,218 @@
+# ----------------------------------------------------------------------------------------
+# dynamic_recon
+# ----------------------------------------------------------------------------------------
+# A reconstruction of long dynamic series (e.g. fMRI EPI or perfusion) which reconstructs
+# one dynamic (or one block of dynamics) after the other. The images are produced by a
+# generator which reads only the profiles of the current dynamics from the rawfile, hence the
+# memory is independent of the number of dynamics and the images of the first dynamic are
+# available as soon as it is reconstructed. Everything which does not change between the
+# dynamics is computed once per mix and stack: the sensitivities, the geometry (see
+# geometry.py), the output format (see output_format.py) and, for EPI scans, the EPI
+# correction. The EPI correction of the first dynamic is only reused for the dynamics with
+# the same echo phase acquisitions (see epi_corrections.py), otherwise it is recomputed for
+# every block.
+#
+# Args:
+#        rawfile (required)            : The path to the Philips rawfile to be reconstructed
+#        refscan (optional)            : The path to the Philips SENSE reference scan
+#        output_path (optional)        : The output path where the results are stored
+#        dynamics-per-block (optional) : The number of dynamics which are reconstructed at once
+#        update-epi-corr (optional)    : When given, the EPI correction is recomputed for every block of dynamics
+#                                        (otherwise it is computed from the first dynamic and reused)
+#
+# The generator can be used in other scripts (e.g. to analyze the dynamics while the scan is
+# being reconstructed):
+#
+#   from dynamic_recon import reconstruct_dynamics
+#   for dynamics, data in reconstruct_dynamics(pars, geometry, mix, stack, sens=sens):
+#       ...
+
+import argparse
+import warnings
+from pathlib import Path
+
+import numpy as np
+from scipy.io import savemat
+
+import precon as pr
+from epi_corrections import echo_phase_keys, grid
+from geometry import GeometryTable
+from output_format import OutputFormatter
+
+
+def epi_correction(raw, pars, geometry, epi_corr2read, mix, stack, dynamics):
+    # computes the EPI correction (slopes and offsets) from the echo phase data of the given dynamics
+    epi_corr2read.dyn = dynamics
+    epi_corr_data, epi_corr_labels = pr.read(raw, epi_corr2read, pars.labels, pars.coil_info, oversampling_removal=False)
+    epi_corr_data = grid(epi_corr_data, pars.get_nus_enc_nrs(), pars.get_range(mix=mix, stack=stack))
+
+    # sort the epi correction data (since ky is always 0 set the grad label as ky)
+    cur_recon_resolution = pars.get_recon_resolution(mix=mix, xovs=True, yovs=True, zovs=True)
+    epi_corr_data, epi_corr_labels = pr.sort(epi_corr_data, epi_corr_labels, output_size=[cur_recon_resolution[0]],
+                                             zeropad=(True, False, False), immediate_averaging=False, ky='grad')
+
+    # FFT along readout direction and shift
+    epi_corr_data = pr.k2i(epi_corr_data, axis=0)
+    xshift = geometry.get_shift(enc=0, mix=mix, stack=stack)
+    if xshift:
+        epi_corr_data = np.roll(epi_corr_data, xshift, axis=0)
+
+    return pr.get_epi_corr_data(epi_corr_data, epi_corr_labels)
+
+
+def reconstruct_dynamics(pars, geometry, mix, stack, sens=None, block_size=1, update_epi_corr=False):
+    """Yields (dynamics, images) for every block of dynamics of the given mix and stack."""
+    epi = pars.is_epi()
+
+    parameter2read = pr.Parameter2Read(pars.labels)
+    parameter2read.mix = mix
+    parameter2read.stack = stack
+    dynamics = list(parameter2read.dyn)
+
+    if epi:
+        epi_corr2read = pr.Parameter2Read(pars.labels)
+        epi_corr2read.mix = mix
+        epi_corr2read.stack = stack
+        epi_corr2read.typ = pr.Label.TYPE_ECHO_PHASE
+        nus_enc_nrs = pars.get_nus_enc_nrs()
+        epi_kx_range = pars.get_range(mix=mix, stack=stack)
+
+        # the epi correction of the first dynamic is reused for all blocks with the same echo phase acquisitions (unless
+        # it is updated for every block)
+        epi_corr = None
+        if not update_epi_corr:
+            keys = echo_phase_keys(pars.labels, mix)
+            first_keys = keys.get(dynamics[0])
+            with open(pars.rawfile, 'rb') as raw:
+                epi_corr = epi_correction(raw, pars, geometry, epi_corr2read, mix, stack, dynamics[:1])
+
+    # the operators which are the same for all dynamics
+    sense_factors = pars.get_value(pars.SENSE_FACTORS, default=[1, 1, 1])
+    regularization_factor = pars.get_value(pars.SENSE_REGULARIZATION_FACTOR, at=0, default=2)
+    kx_range, ky_range, kz_range = geometry.get_ranges(mix, stack)
+    partial_fourier = geometry.is_partial_fourier(mix, stack)
+    r, gys, gxc, gz = pars.get_geo_corr_pars()
+    voxel_sizes = geometry.get_voxel_sizes(mix=mix)
+    sampled_size = (pars.get_sampled_size(enc=0, stack=stack, ovs=False), pars.get_sampled_size(enc=1, stack=stack),
+                    pars.get_sampled_size(enc=2, stack=stack))
+    formatter = OutputFormatter(geometry.get_oversampling(enc=1, mix=mix), geometry.get_oversampling(enc=2, mix=mix),
+                                geometry.get_in_plane_transformation(mix=mix, stack=stack))
+
+    with open(pars.rawfile, 'rb') as raw:
+        for i in range(0, len(dynamics), block_size):
+            block = dynamics[i:i + block_size]
+            parameter2read.dyn = block
+
+            if epi:
+                # read data
+                data, labels = pr.read(raw, parameter2read, pars.labels, pars.coil_info, oversampling_removal=False)
+                data = grid(data, nus_enc_nrs, epi_kx_range)
+
+                # sort and zero fill data (create k-space)
+                cur_recon_resolution = pars.get_recon_resolution(mix=mix, xovs=True, yovs=True, zovs=True)
+                data, labels = pr.sort(data, labels, output_size=cur_recon_resolution)
+
+                # FFT along readout direction, shift and epi correction
+                data = pr.k2i(data, axis=0)
+                xshift = geometry.get_shift(enc=0, mix=mix, stack=stack)
+                if xshift:
+                    data = np.roll(data, xshift, axis=0)
+                if not update_epi_corr and any(keys.get(dyn) != first_keys for dyn in block):
+                    warnings.warn(f'the echo phase acquisitions of the dynamics {block} differ from the first dynamic, '
+                                  f'the epi correction is recomputed for every block')
+                    update_epi_corr = True
+                if update_epi_corr:
+                    epi_corr = epi_correction(raw, pars, geometry, epi_corr2read, mix, stack, block)
+                data = pr.epi_corr(data, labels, *epi_corr)
+
+                # FFT along phase encoding direction
+                data = pr.k2i(data, axis=(1, 2))
+            else:
+                # read data
+                data, labels = pr.read(raw, parameter2read, pars.labels, pars.coil_info)
+
+                # sort and zero fill data (create k-space)
+                cur_recon_resolution = pars.get_recon_resolution(mix=mix, xovs=False, yovs=True, zovs=True, folded=sens is not None)
+                data, labels = pr.sort(data, labels, output_size=cur_recon_resolution)
+
+                # ringing filter (as in sense_recon.py)
+                if sens is not None:
+                    data = pr.hamming_filter(data, (0.25, 0.25, 0.25), axis=(0, 1, 2), sampled_size=sampled_size)
+
+                # FFT
+                data = pr.k2i(data, axis=(0, 1, 2))
+
+            # shift data in image space
+            yshift = geometry.get_shift(enc=1, mix=mix, stack=stack)
+            zshift = geometry.get_shift(enc=2, mix=mix, stack=stack)
+            if yshift:
+                data = np.roll(data, yshift, axis=1)
+            if zshift:
+                data = np.roll(data, zshift, axis=2)
+
+            # remove the oversampling along readout direction
+            if epi:
+                data = pr.crop(data, axis=0, factor=geometry.get_oversampling(enc=0, mix=mix), where='symmetric')
+
+            # SENSE unfolding
+            if sens is not None:
+                if epi:
+                    data = pr.sense_unfold(data, sens, sense_factors, regularization_factor=regularization_factor)
+                else:
+                    output_size = pars.get_recon_resolution(mix=mix, xovs=False, yovs=True, zovs=True, folded=False)
+                    data = pr.sense_unfold(data, sens, output_size, regularization_factor=regularization_factor)
+
+            # partial fourier reconstruction
+            if partial_fourier:
+                data = pr.homodyne(data, kx_range, ky_range, kz_range)
+
+            # combine coils with a sum-of squares combination
+            if sens is None:
+                data = pr.sos(data, axis=3)
+
+            # perform geometry correction
+            locations = pr.utils.get_unique(labels, 'loca')
+            MPS_to_XYZ = geometry.get_transformation_matrix(loca=locations, mix=mix)
+            data = pr.geo_corr(data, MPS_to_XYZ, r, gys, gxc, gz, voxel_sizes=voxel_sizes)
+
+            # remove the oversampling, transform the images into the radiological convention and make them square
+            yield block, formatter.apply(data)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='dynamic recon')
+    parser.add_argument('rawfile', help='path to the raw or lab file')
+    parser.add_argument('--refscan', default=None, help='path to the sense reference scan')
+    parser.add_argument('--output-path', default='./', help='path where the output is saved')
+    parser.add_argument('--dynamics-per-block', type=int, default=1, help='the number of dynamics reconstructed at once')
+    parser.add_argument('--update-epi-corr', action='store_true', help='recompute the epi correction for every block')
+    args = parser.parse_args()
+
+    # read parameter
+    pars = pr.Parameter(Path(args.rawfile))
+
+    # the geometry of all mixes, stacks and locations
+    geometry = GeometryTable(pars)
+
+    if args.refscan:
+        # reconstruct refscan
+        ref_pars = pr.Parameter(Path(args.refscan))
+        qbc, coil = pr.reconstruct_refscan(ref_pars)
+
+    # define what to read
+    parameter2read = pr.Parameter2Read(pars.labels)
+
+    # open the matlab file such that the results can be appended as soon as a block of dynamics is reconstructed
+    with open(Path(args.output_path) / 'data.mat', 'wb') as mat_file:
+        # reconstruct every mix and stack seperately
+        for mix in parameter2read.mix:
+            for stack in parameter2read.stack:
+                sens = None
+                if args.refscan:
+                    # calculate the sensitivities (once for all dynamics)
+                    sens = pr.reformat_refscan(qbc, coil, ref_pars, pars, stack=stack, mix=mix, match_target_size=True)
+
+                for dynamics, data in reconstruct_dynamics(pars, geometry, mix, stack, sens=sens, block_size=args.dynamics_per_block,
+                                                           update_epi_corr=args.update_epi_corr):
+                    # append the dynamics to the .mat file
+                    savemat(mat_file, {f'data_{mix}_{stack}_{dynamics[0]}': data})
@@ -0,0 +1,48 @@
+# ----------------------------------------------------------------------------------------
+# epi_corrections
+# ----------------------------------------------------------------------------------------
+# Helpers of the EPI reconstruction which are shared by epi_recon.py and dynamic_recon.py.
+#
+#   grid                 : grids the samples from the non-uniform-sampling coordinates onto a regular grid (needed
+#                          because the data is sampled on the gradient ramp)
+#   echo_phase_keys      : the echo phase (EPI correction) acquisitions of every dynamic, without the dynamic and the
+#                          position in the rawfile. An EPI correction computed from one dynamic can only be applied to
+#                          other dynamics with the same keys.
+#
+# Usage:
+#
+#   from epi_corrections import echo_phase_keys, grid
+#
+#   data = grid(data, pars.get_nus_enc_nrs(), pars.get_range(mix=mix, stack=stack))
+#   keys = echo_phase_keys(pars.labels, mix)
+#   same_correction = keys[dyn] == keys[first_dyn]
+
+from collections import defaultdict
+
+import numpy as np
+from scipy.interpolate import interp1d
+
+import precon as pr
+from label_array import labels_to_array
+
+# the label fields which identify an echo phase acquisition (the fields which are not in the labels are ignored)
+ECHO_PHASE_FIELDS = ('mix', 'loca', 'echo', 'card', 'extr1', 'extr2', 'grad', 'ky', 'kz', 'rf_echo', 'grad_echo')
+
+
+def grid(data, nus_enc_nrs, kx_range):
+    # grid the data from the nus encoding numbers to a regular grid
+    # (interp1d always returns double precision, therefore we cast the result back to the precision of the raw data)
+    f = interp1d(nus_enc_nrs, data, axis=0, bounds_error=False, fill_value=0)
+    return f(np.arange(kx_range[0], kx_range[1] + 1)).astype(data.dtype, copy=False)
+
+
+def echo_phase_keys(labels, mix):
+    """Returns a dict which maps every dynamic to the set of its echo phase acquisitions (of the given mix)."""
+    table = labels_to_array(labels)
+    table = table[(table['typ'] == pr.Label.TYPE_ECHO_PHASE) & (table['mix'] == mix)]
+    fields = [field for field in ECHO_PHASE_FIELDS if field in table.dtype.names]
+
+    keys = defaultdict(set)
+    for dyn, row in zip(table['dyn'].tolist(), table[fields].tolist()):
+        keys[dyn].add(row)
+    return {dyn: frozenset(rows) for dyn, rows in keys.items()}
@@ -0,0 +1,129 @@
+# ----------------------------------------------------------------------------------------
+# export_hdf5
+# ----------------------------------------------------------------------------------------
+# Exports the sorted k-space and the reconstructed images into a chunked and compressed
+# HDF5 file (e.g. as input for machine learning). Every 2D slice of every coil is stored
+# in its own chunk such that individual slices or coils can be read without loading the
+# whole dataset. The labels and the geometry are stored alongside the data.
+#
+# Args:
+#        rawfile (required)          : The path to the Philips rawfile to be reconstructed
+#        output_path (optional)      : The output path where the results are stored
+#        compression-level (optional): The gzip compression level (0-9)
+#
+# The HDF5 file contains one group per mix and stack ('mix_<mix>_stack_<stack>') with:
+#
+#   kspace       : The sorted and zero-filled k-space (output of pr.sort)
+#   image        : The reconstructed images (same pipeline as simple_recon.py)
+#   labels       : The labels of the k-space profiles as a table (one column per label field)
+#   mps_to_xyz   : The transformation matrices from MPS to XYZ for every location
+#   voxel_sizes  : The voxel sizes (attribute)
+#
+# The data can be read partially with h5py, e.g. the first slice of the third coil:
+#
+#   with h5py.File('my_rawfile.h5', 'r') as f:
+#       slice = f['mix_0_stack_0/kspace'][:, :, 0, 2, ...]
+#
+# Requires: h5py
+
+import argparse
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+import precon as pr
+from label_array import labels_to_array
+
+parser = argparse.ArgumentParser(description='export to hdf5')
+parser.add_argument('rawfile', help='path to the raw or lab file')
+parser.add_argument('--output-path', default='./', help='path where the output is saved')
+parser.add_argument('--compression-level', type=int, default=4, help='the gzip compression level (0-9)')
+args = parser.parse_args()
+
+
+def write_chunked(group, name, data):
+    # one chunk per 2D slice and coil
+    chunks = data.shape[:2] + (1,) * (data.ndim - 2)
+    return group.create_dataset(name, data=data, chunks=chunks, compression='gzip',
+                                compression_opts=args.compression_level, shuffle=True)
+
+
+# read parameter
+pars = pr.Parameter(Path(args.rawfile))
+
+# define what to read
+parameter2read = pr.Parameter2Read(pars.labels)
+
+# enable performance logging (reconstruction times)
+pars.performance_logging = True
+
+with h5py.File(Path(args.output_path) / f'{pars.rawfile.stem}.h5', 'w') as h5:
+    # reconstruct every mix and stack seperately
+    for mix in parameter2read.mix:
+        for stack in parameter2read.stack:
+            parameter2read.stack = stack
+            parameter2read.mix = mix
+
+            group = h5.create_group(f'mix_{mix}_stack_{stack}')
+
+            # read data
+            with open(pars.rawfile, 'rb') as raw:
+                data, labels = pr.read(raw, parameter2read, pars.labels, pars.coil_info)
+
+            # sort and zero fill data (create k-space)
+            cur_recon_resolution = pars.get_recon_resolution(mix=mix, xovs=False, yovs=True, zovs=True)
+            data, labels = pr.sort(data, labels, output_size=cur_recon_resolution)
+
+            # export the k-space and the labels
+            write_chunked(group, 'kspace', data)
+            group.create_dataset('labels', data=labels_to_array(labels), compression='gzip',
+                                 compression_opts=args.compression_level)
+
+            # export the geometry
+            locations = pr.utils.get_unique(labels, 'loca')
+            MPS_to_XYZ = pars.get_transformation_matrix(loca=locations, mix=mix, target=pr.Enums.XYZ)
+            voxel_sizes = pars.get_voxel_sizes(mix=mix)
+            group.create_dataset('mps_to_xyz', data=np.asarray(MPS_to_XYZ))
+            group['mps_to_xyz'].attrs['locations'] = np.asarray(locations)
+            group.attrs['voxel_sizes'] = np.asarray(voxel_sizes)
+
+            # FFT
+            data = pr.k2i(data, axis=(0, 1, 2))
+
+            # shift data in image space
+            yshift = pars.get_shift(enc=1, mix=mix, stack=stack)
+            zshift = pars.get_shift(enc=2, mix=mix, stack=stack)
+            if yshift:
+                data = np.roll(data, yshift, axis=1)
+            if zshift:
+                data = np.roll(data, zshift, axis=2)
+
+            # partial fourier reconstruction
+            kx_range = pars.get_range(enc=0, mix=mix, stack=stack, ovs=False)
+            ky_range = pars.get_range(enc=1, mix=mix, stack=stack)
+            kz_range = pars.get_range(enc=2, mix=mix, stack=stack)
+            if pr.is_partial_fourier(kx_range) or pr.is_partial_fourier(ky_range) or pr.is_partial_fourier(kz_range):
+                data = pr.homodyne(data, kx_range, ky_range, kz_range)
+
+            # combine coils with a sum-of squares combination
+            data = pr.sos(data, axis=3)
+
+            # perform geometry correction
+            r, gys, gxc, gz = pars.get_geo_corr_pars()
+            data = pr.geo_corr(data, MPS_to_XYZ, r, gys, gxc, gz, voxel_sizes=voxel_sizes)
+
+            # remove the oversampling
+            yovs = pars.get_oversampling(enc=1, mix=mix)
+            zovs = pars.get_oversampling(enc=2, mix=mix)
+            data = pr.crop(data, axis=(1, 2), factor=(yovs, zovs), where='symmetric')
+
+            # transform the images into the radiological convention
+            data = pr.format(data, pars.get_in_plane_transformation(mix=mix, stack=stack))
+
+            # make the image square
+            res = max(data.shape[0], data.shape[1])
+            data = pr.zeropad(data, (res, res), axis=(0, 1))
+
+            # export the images
+            write_chunked(group, 'image', data)
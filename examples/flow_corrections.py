@@ -0,0 +1,120 @@
+# ----------------------------------------------------------------------------------------
+# flow_corrections
+# ----------------------------------------------------------------------------------------
+# Phase corrections of flow data which are shared by flow_recon.py and flow_recon_sin.py.
+#
+#   concomitant_field_correction : the concomitant field correction, computed once for all channels, dynamics,
+#                                  cardiac phases and echoes and applied with a single broadcast multiplication
+#   fast_fit_flow_phase          : removes the background phase of the static tissue with a polynomial fit of all
+#                                  cardiac phases and velocity segments at once
+#
+# Usage:
+#
+#   from flow_corrections import concomitant_field_correction, fast_fit_flow_phase
+#
+#   data = concomitant_field_correction(data, MPS_to_XYZ, concom_factors, voxel_sizes, segments)
+#   data = pr.divide_flow_segments(data, pars.is_hadamard_encoding())
+#   data = fast_fit_flow_phase(data, order=3)
+#
+# fast_fit_flow_phase is an alternative to pr.fit_flow_phase and its results are not identical:
+#
+#   - the data must contain the velocity segments, i.e. the phase differences to the reference
+#     segment (after pr.divide_flow_segments). A segment which is not velocity encoded can be
+#     excluded with the segments argument.
+#   - the static tissue is given by the caller (static_mask) or estimated with a simple
+#     heuristic (sufficient signal and a low velocity phase variation over the cardiac cycle),
+#     which is not the static tissue mask of pr.fit_flow_phase.
+#   - the mean background phase of the static tissue is removed before the fit (with the
+#     complex mean), so a constant background of any size is handled. The remaining variation
+#     of the background over the static tissue must be within +-pi (the phase is not unwrapped).
+#   - the fit is unweighted (least squares of the phase of every static tissue pixel).
+
+from functools import lru_cache
+
+import numpy as np
+
+import precon as pr
+
+# the data dimensions which share the same concomitant field correction
+CONCOM_SHARED_DIMS = (pr.Enums.CHANNEL_DIM, pr.Enums.DYN_DIM, pr.Enums.CARDIAC_DIM, pr.Enums.ECHO_DIM)
+
+
+def concomitant_field_correction(data, MPS_to_XYZ, concom_factors, voxel_sizes, segments):
+    # the correction is a phase which is the same for all channels, dynamics, cardiac phases and echoes. Therefore, the
+    # correction map is computed only once (by correcting an array of ones without these dimensions) and then applied
+    # to the data with a single broadcast multiplication.
+    shape = list(data.shape)
+    for dim in CONCOM_SHARED_DIMS:
+        shape[dim] = 1
+    ones = np.ones(tuple(shape), dtype=data.dtype, order='F')
+    data *= pr.concomitant_field_correction(ones, MPS_to_XYZ, concom_factors, voxel_sizes, segments)
+    return data
+
+
+@lru_cache(maxsize=8)
+def polynomial_basis(nx, ny, order):
+    # the 2D polynomial basis of the given order on the image grid (one column per polynomial term)
+    x, y = np.meshgrid(np.linspace(-1, 1, nx), np.linspace(-1, 1, ny), indexing='ij')
+    terms = [x ** i * y ** j for i in range(order + 1) for j in range(order + 1 - i)]
+    return np.stack(terms, axis=-1).reshape(nx * ny, -1)
+
+
+def _images(data):
+    # a view of the data with the cardiac phases and the flow segments as the last dimensions
+    return np.moveaxis(data, (pr.Enums.CARDIAC_DIM, pr.Enums.FLOW_SEGMENT_DIM), (-2, -1))
+
+
+def estimate_static_mask(data, segments, magnitude_threshold=0.1, static_fraction=0.3):
+    # a heuristic static tissue mask of every image: the pixels with a sufficient signal and a velocity phase variation
+    # over the cardiac cycle which is within the lowest static_fraction of these pixels. The mask has the size of the
+    # data without the cardiac phases and the flow segments.
+    view = _images(data)[..., segments]
+    magnitude = np.abs(view).mean(axis=(-2, -1))
+    variation = np.angle(view).std(axis=-2).mean(axis=-1)
+
+    mask = np.zeros(view.shape[:-2], dtype=bool)
+    for index in np.ndindex(mask.shape[2:]):
+        image = (slice(None), slice(None)) + index
+        signal = magnitude[image] > magnitude_threshold * magnitude[image].max()
+        if np.any(signal):
+            mask[image] = signal & (variation[image] <= np.quantile(variation[image][signal], static_fraction))
+    return mask
+
+
+def fast_fit_flow_phase(data, order=3, static_mask=None, segments=None):
+    # fits a polynomial to the velocity phase of the static tissue and removes it. Since the design matrix only depends
+    # on the grid and the mask, its pseudo-inverse is computed once per image and all cardiac phases and velocity
+    # segments are fitted with a single matrix product.
+    #
+    #   static_mask : a boolean mask of the static tissue with the size of the data without the cardiac phases and the
+    #                 flow segments (default: the heuristic of estimate_static_mask)
+    #   segments    : the indices of the velocity segments along FLOW_SEGMENT_DIM (default: all segments), the other
+    #                 segments are not changed
+    nx, ny = data.shape[0], data.shape[1]
+    basis = polynomial_basis(nx, ny, order)
+    view = _images(data)
+    if segments is None:
+        segments = list(range(view.shape[-1]))
+    if static_mask is None:
+        static_mask = estimate_static_mask(data, segments)
+    elif static_mask.shape != view.shape[:-2]:
+        raise ValueError(f'the static mask has the wrong size: {static_mask.shape} (expected {view.shape[:-2]})')
+
+    for index in np.ndindex(view.shape[2:-2]):
+        image = (slice(None), slice(None)) + index
+        mask = static_mask[image].ravel()
+        if np.count_nonzero(mask) < basis.shape[1]:
+            continue
+        images = view[image]
+        velocity = images[..., segments]
+        static = velocity.reshape(nx * ny, -1)[mask]
+
+        # remove the mean phase of the static tissue first, so only the variation of the background is fitted
+        offset = np.angle(static.sum(axis=0))
+        phase = np.angle(static * np.exp(-1j * offset))
+
+        # fit all cardiac phases and velocity segments at once
+        coefficients = np.linalg.pinv(basis[mask]) @ phase
+        background = (basis @ coefficients + offset).reshape(velocity.shape)
+        images[..., segments] = velocity * np.exp(-1j * background).astype(velocity.dtype, copy=False)
+    return data
@@ -0,0 +1,125 @@
+# ----------------------------------------------------------------------------------------
+# geometry
+# ----------------------------------------------------------------------------------------
+# A geometry table which holds the geometry of all mixes, stacks and locations of a scan in
+# contiguous arrays. It is built once after the parameters are read, so the reconstruction
+# loops do not have to query the parameters again for every mix, stack and flow segment.
+# The MPS to XYZ transformation matrices of all locations are stored, such that the
+# matrices of any set of locations (e.g. all slices of a stack) can be passed directly to
+# pr.geo_corr or pr.concomitant_field_correction. The matrices are queried once per
+# location and joined in the same way as pr.Parameter joins the matrices of several
+# locations.
+#
+# Usage:
+#
+#   from geometry import GeometryTable
+#
+#   pars = pr.Parameter(Path(rawfile))
+#   geometry = GeometryTable(pars)
+#
+#   yshift = geometry.get_shift(enc=1, mix=mix, stack=stack)
+#   kx_range, ky_range, kz_range = geometry.get_ranges(mix, stack)
+#   MPS_to_XYZ = geometry.get_transformation_matrix(loca=locations, mix=mix)
+#
+# The getters have the same names as the ones of pr.Parameter, hence they can be used as a
+# drop-in replacement in the examples.
+#
+# The table contains the following arrays (indexed with the positions of the mixes, stacks
+# and locations, see geometry.mixes, geometry.stacks and geometry.locations):
+#
+#   shifts        : (mixes, stacks, 3)       the shifts in image space along x, y and z
+#   kspace_ranges : (mixes, stacks, 3, 2)    the k-space ranges along kx (without oversampling), ky and kz
+#   oversampling  : (mixes, 3)               the oversampling factors along x, y and z
+#   voxel_sizes   : (mixes, ...)             the voxel sizes
+#   in_plane      : (mixes, stacks)          the in-plane transformations into the radiological convention
+#   MPS_to_XYZ    : (mixes, locations, ...)  the transformation matrix of every location
+
+import numpy as np
+
+import precon as pr
+
+
+def _join_locations(matrices, all_matrices):
+    # finds how precon joins the matrices of several locations (stacked along a new axis or concatenated along an
+    # existing axis) by comparing the values, since the shapes alone are ambiguous (e.g. 4 locations of 4x4 matrices)
+    for join in (np.stack, np.concatenate):
+        for axis in range(matrices[0].ndim + (join is np.stack)):
+            try:
+                joined = join(matrices, axis=axis)
+            except ValueError:
+                continue
+            if joined.shape == all_matrices.shape and np.array_equal(joined, all_matrices):
+                return join, axis
+    raise ValueError(f'the transformation matrices of several locations {all_matrices.shape} cannot be assembled from '
+                     f'the matrices of the single locations {matrices[0].shape}')
+
+
+class GeometryTable:
+    """The geometry of all mixes, stacks and locations of a scan."""
+
+    def __init__(self, pars):
+        parameter2read = pr.Parameter2Read(pars.labels)
+        self.mixes = list(parameter2read.mix)
+        self.stacks = list(parameter2read.stack)
+        self.locations = list(pr.utils.get_unique(pars.labels, 'loca'))
+        self._mix_index = {mix: i for i, mix in enumerate(self.mixes)}
+        self._stack_index = {stack: i for i, stack in enumerate(self.stacks)}
+        self._location_index = {loca: i for i, loca in enumerate(self.locations)}
+
+        nr_mixes, nr_stacks = len(self.mixes), len(self.stacks)
+        self.shifts = np.zeros((nr_mixes, nr_stacks, 3), dtype=int)
+        self.kspace_ranges = np.zeros((nr_mixes, nr_stacks, 3, 2), dtype=int)
+        self.oversampling = np.ones((nr_mixes, 3))
+        self.in_plane = np.empty((nr_mixes, nr_stacks), dtype=object)
+
+        matrices = [[] for _ in self.mixes]
+        for m, mix in enumerate(self.mixes):
+            self.oversampling[m] = [pars.get_oversampling(enc=enc, mix=mix) for enc in range(3)]
+            for s, stack in enumerate(self.stacks):
+                self.shifts[m, s] = [pars.get_shift(enc=enc, mix=mix, stack=stack) for enc in range(3)]
+                self.kspace_ranges[m, s] = [pars.get_range(enc=0, mix=mix, stack=stack, ovs=False),
+                                            pars.get_range(enc=1, mix=mix, stack=stack),
+                                            pars.get_range(enc=2, mix=mix, stack=stack)]
+                self.in_plane[m, s] = pars.get_in_plane_transformation(mix=mix, stack=stack)
+            for location in self.locations:
+                matrices[m].append(np.asarray(pars.get_transformation_matrix(loca=[location], mix=mix, target=pr.Enums.XYZ)))
+        self.MPS_to_XYZ = np.ascontiguousarray(np.array(matrices))
+        self.voxel_sizes = np.stack([np.asarray(pars.get_voxel_sizes(mix=mix), dtype=float) for mix in self.mixes])
+
+        # the matrices of several locations are joined in the same way as by pr.Parameter
+        self._join, self.location_axis = None, None
+        if len(self.locations) > 1:
+            all_matrices = np.asarray(pars.get_transformation_matrix(loca=self.locations, mix=self.mixes[0], target=pr.Enums.XYZ))
+            self._join, self.location_axis = _join_locations(list(self.MPS_to_XYZ[0]), all_matrices)
+
+    def _index(self, mix, stack=None):
+        if stack is None:
+            return self._mix_index[mix]
+        return self._mix_index[mix], self._stack_index[stack]
+
+    def get_shift(self, enc, mix, stack):
+        return int(self.shifts[self._index(mix, stack)][enc])
+
+    def get_ranges(self, mix, stack):
+        # the k-space ranges along kx (without oversampling), ky and kz
+        return [r.tolist() for r in self.kspace_ranges[self._index(mix, stack)]]
+
+    def is_partial_fourier(self, mix, stack):
+        return any(pr.is_partial_fourier(r) for r in self.get_ranges(mix, stack))
+
+    def get_oversampling(self, enc, mix):
+        return float(self.oversampling[self._index(mix), enc])
+
+    def get_voxel_sizes(self, mix):
+        return self.voxel_sizes[self._index(mix)]
+
+    def get_in_plane_transformation(self, mix, stack):
+        return self.in_plane[self._index(mix, stack)]
+
+    def get_transformation_matrix(self, loca, mix):
+        """Returns the stacked MPS to XYZ transformation matrices of the given locations."""
+        matrices = self.MPS_to_XYZ[self._index(mix)]
+        indices = [self._location_index[location] for location in np.atleast_1d(loca)]
+        if len(indices) == 1:
+            return matrices[indices[0]]
+        return self._join(matrices[indices], axis=self.location_axis)
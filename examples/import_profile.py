@@ -0,0 +1,104 @@
+# ----------------------------------------------------------------------------------------
+# import_profile
+# ----------------------------------------------------------------------------------------
+# Reports the time needed to import precon, broken down by the imported packages, and checks
+# whether heavy optional backends (e.g. torch) are loaded on import. Optionally, the time
+# needed to parse the labels of a rawfile is measured as well. The import is performed in a
+# fresh interpreter such that already imported modules do not distort the result.
+#
+# Args:
+#        rawfile (optional): The path to a raw or lab file. When given, the time to parse the parameters and labels is reported
+#        top (optional)    : The number of packages shown in the breakdown
+#        json (optional)   : When given, the report is printed as json (e.g. for monitoring)
+#
+# Example:
+#
+#   python import_profile.py --rawfile my_rawfile.raw --top 15
+
+import argparse
+import json
+import subprocess
+import sys
+from collections import defaultdict
+
+# optional backends which should not be loaded when only labels are parsed
+HEAVY_MODULES = ('torch', 'scipy', 'matplotlib', 'numba', 'cupy')
+
+# runs in a fresh interpreter: imports precon, optionally parses the labels and reports the loaded modules and times
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import precon as pr
+import_time = time.perf_counter() - start
+parse_time = None
+if len(sys.argv) > 1:
+    from pathlib import Path
+    start = time.perf_counter()
+    pars = pr.Parameter(Path(sys.argv[1]))
+    labels = pars.labels
+    parse_time = time.perf_counter() - start
+print(json.dumps({'import_time': import_time, 'parse_time': parse_time, 'modules': sorted(sys.modules)}))
+'''
+
+
+def parse_importtime(stderr, package='precon'):
+    # the output of -X importtime has the format 'import time: self [us] | cumulative | imported package', where nested
+    # imports are indented and printed before the package which imports them. The breakdown contains the packages which
+    # are directly imported by the given package (the cumulative time of a package includes all its submodules).
+    subtree = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        if level == 0:
+            if name == package:
+                break
+            subtree = []
+        else:
+            subtree.append((level, name, int(cumulative_us)))
+
+    breakdown = defaultdict(int)
+    for level, name, cumulative_us in subtree:
+        if level == 1:
+            breakdown[name] += cumulative_us
+    return breakdown
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='precon import profile')
+    parser.add_argument('--rawfile', default=None, help='path to the raw or lab file')
+    parser.add_argument('--top', type=int, default=10, help='the number of packages shown in the breakdown')
+    parser.add_argument('--json', action='store_true', help='print the report as json')
+    args = parser.parse_args()
+
+    cmd = [sys.executable, '-X', 'importtime', '-c', PROBE]
+    if args.rawfile:
+        cmd.append(args.rawfile)
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f'import of precon failed:\n{result.stderr}')
+
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+    breakdown = sorted(parse_importtime(result.stderr).items(), key=lambda x: x[1], reverse=True)[:args.top]
+    heavy = [m for m in HEAVY_MODULES if m in probe['modules']]
+
+    report = {
+        'import_time': probe['import_time'],
+        'parse_time': probe['parse_time'],
+        'breakdown': {name: us / 1e6 for name, us in breakdown},
+        'heavy_modules': heavy,
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f'import precon: {report["import_time"]:.3f}s')
+        if report['parse_time'] is not None:
+            print(f'parse labels : {report["parse_time"]:.3f}s')
+        print(f'\ncumulative import time of the top {args.top} packages imported by precon:')
+        for name, seconds in report['breakdown'].items():
+            print(f'  {name:<30} {seconds:.3f}s')
+        if heavy:
+            print(f'\nheavy modules loaded on import: {", ".join(heavy)}')
@@ -0,0 +1,47 @@
+# ----------------------------------------------------------------------------------------
+# instrument
+# ----------------------------------------------------------------------------------------
+# Replaces the public precon functions with wrappers (e.g. to cast the results, see
+# precision.py, or to record the memory of every call, see memtrace.py). All callables of
+# the precon module are wrapped (or only the given names), except classes and modules, since
+# the functions of the compiled package are not necessarily python functions (e.g. cython
+# functions).
+#
+# Usage:
+#
+#   from instrument import restore_functions, wrap_functions
+#
+#   def make_wrapper(name, func):
+#       ...
+#
+#   originals = wrap_functions(make_wrapper)
+#   ...
+#   restore_functions(originals)
+
+import inspect
+import warnings
+
+import precon as pr
+
+
+def wrap_functions(make_wrapper, names=None):
+    """Replaces every public pr.* function (or the given ones) by make_wrapper(name, func) and returns the originals."""
+    originals = dict()
+    for name, obj in list(vars(pr).items()):
+        if name.startswith('_') or not callable(obj) or inspect.isclass(obj) or inspect.ismodule(obj):
+            continue
+        if names is not None and name not in names:
+            continue
+        originals[name] = obj
+        setattr(pr, name, make_wrapper(name, obj))
+
+    if not originals:
+        warnings.warn('no precon functions were found, the instrumentation has no effect')
+    return originals
+
+
+def restore_functions(originals):
+    """Restores the original pr.* functions which were returned by wrap_functions."""
+    for name, func in originals.items():
+        setattr(pr, name, func)
+    originals.clear()
@@ -0,0 +1,26 @@
+# ----------------------------------------------------------------------------------------
+# label_array
+# ----------------------------------------------------------------------------------------
+# Converts the labels of a rawfile (pars.labels or the labels returned by pr.read) into a
+# numpy record array with one column per label field, e.g. to select or count labels with
+# numpy instead of looping over the labels in python.
+#
+# Usage:
+#
+#   from label_array import labels_to_array
+#
+#   table = labels_to_array(pars.labels)
+#   normal_data = table[table['typ'] == pr.Enums.NORMAL_DATA]
+
+import ctypes
+
+import numpy as np
+
+
+def labels_to_array(labels):
+    """Returns the labels (ctypes structures) as a numpy record array with one column per label field."""
+    if not isinstance(labels, ctypes.Array):
+        # a sequence of labels is copied into a ctypes array once
+        labels = (type(labels[0]) * len(labels))(*labels)
+    # the array is a view of the ctypes buffer (the fields and the padding are given by the structure)
+    return np.frombuffer(labels, dtype=np.dtype(labels._type_))
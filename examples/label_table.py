@@ -0,0 +1,123 @@
+# ----------------------------------------------------------------------------------------
+# label_table
+# ----------------------------------------------------------------------------------------
+# Exports the labels of Philips rawfiles into a columnar table (one array per label field,
+# stored as .npz) and queries these tables. In contrast to print_labels.py, this also works
+# for lab files with millions of labels and for thousands of archived scans.
+#
+# Usage:
+#
+#   export the labels of one or more rawfiles (one <name>_labels.npz file per rawfile):
+#
+#       python label_table.py export my_rawfile_1.raw my_rawfile_2.raw --output-path ./labels
+#
+#   count the labels for every combination of the given fields, filtered by label values:
+#
+#       python label_table.py query ./labels/*.npz --where typ=1 mix=0 --count-by dyn card
+#
+#   show the first labels which match the filter:
+#
+#       python label_table.py query ./labels/my_rawfile_1_labels.npz --where extr1=0,1 --head 20
+#
+# A filter has the format <field>=<value>[,<value>...] and all filters must match.
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from label_array import labels_to_array
+
+
+def export(rawfiles, output_path):
+    import precon as pr
+
+    for rawfile in rawfiles:
+        pars = pr.Parameter(Path(rawfile))
+        table = labels_to_array(pars.labels)
+        filename = Path(output_path) / f'{Path(rawfile).stem}_labels.npz'
+        np.savez(filename, **{name: table[name] for name in table.dtype.names})
+        print(f'{filename}: {len(table)} labels')
+
+
+def parse_filters(where):
+    filters = dict()
+    for condition in where:
+        field, _, values = condition.partition('=')
+        if not values:
+            raise ValueError(f'invalid filter: {condition} (must be <field>=<value>[,<value>...])')
+        filters[field] = [int(v) for v in values.split(',')]
+    return filters
+
+
+def select(columns, filters):
+    mask = np.ones(len(next(iter(columns.values()))), dtype=bool)
+    for field, values in filters.items():
+        if field not in columns:
+            raise KeyError(f'unknown label field: {field}')
+        mask &= np.isin(columns[field], values)
+    return mask
+
+
+def query(tables, filters, count_by, head):
+    counts = dict()
+    for filename in tables:
+        with np.load(filename) as npz:
+            unknown = [field for field in count_by if field not in npz.files]
+            if unknown:
+                raise KeyError(f'unknown label field: {", ".join(unknown)} (available: {", ".join(npz.files)})')
+            # only load the columns which are needed
+            fields = [f for f in npz.files if f in filters or f in count_by] if count_by else npz.files
+            columns = {field: npz[field] for field in fields}
+        mask = select(columns, filters)
+
+        if not count_by:
+            rows = np.flatnonzero(mask)[:head]
+            names = list(columns)
+            print(f'{filename}: {np.count_nonzero(mask)} labels')
+            print(' '.join(f'{name:>8}' for name in names))
+            for row in rows:
+                print(' '.join(f'{str(columns[name][row]):>8}' for name in names))
+            continue
+
+        if not np.any(mask):
+            continue
+        # encode every combination of the label values as a single integer such that it can be counted at once
+        # (relative to the minimum of every field, since some fields are signed, e.g. ky)
+        keys = [columns[field][mask].astype(np.int64) for field in count_by]
+        offsets = [int(key.min()) for key in keys]
+        dims = [int(key.max()) - offset + 1 for key, offset in zip(keys, offsets)]
+        codes = np.ravel_multi_index([key - offset for key, offset in zip(keys, offsets)], dims)
+        unique_codes, unique_counts = np.unique(codes, return_counts=True)
+        for key, count in zip(zip(*np.unravel_index(unique_codes, dims)), unique_counts):
+            key = tuple(int(k) + offset for k, offset in zip(key, offsets))
+            counts[key] = counts.get(key, 0) + int(count)
+
+    if count_by:
+        print(' '.join(f'{field:>8}' for field in count_by) + f' {"count":>10}')
+        for key in sorted(counts):
+            print(' '.join(f'{value:>8}' for value in key) + f' {counts[key]:>10}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='label table')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='export the labels into a columnar table')
+    export_parser.add_argument('rawfiles', nargs='+', help='paths to the raw or lab files')
+    export_parser.add_argument('--output-path', default='./', help='path where the tables are saved')
+
+    query_parser = subparsers.add_parser('query', help='filter and count labels')
+    query_parser.add_argument('tables', nargs='+', help='paths to the exported label tables (.npz)')
+    query_parser.add_argument('--where', nargs='*', default=[], help='filters in the format <field>=<value>[,<value>...]')
+    query_parser.add_argument('--count-by', nargs='*', default=[], help='count the labels for every combination of these fields')
+    query_parser.add_argument('--head', type=int, default=10, help='the number of labels shown when not counting')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        export(args.rawfiles, args.output_path)
+    else:
+        try:
+            query(args.tables, parse_filters(args.where), args.count_by, args.head)
+        except (KeyError, ValueError) as e:
+            parser.error(e.args[0])
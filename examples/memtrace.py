@@ -0,0 +1,167 @@
+# ----------------------------------------------------------------------------------------
+# memtrace
+# ----------------------------------------------------------------------------------------
+# Runs a reconstruction script and records the memory behaviour of every precon function
+# call. For every pr.* call the following is recorded (with tracemalloc):
+#
+#   allocated : the memory which is still allocated after the call (e.g. the output array)
+#   peak      : the peak memory during the call (relative to the memory before the call)
+#   copy      : whether an output array is a new array or a view/in-place result of an input
+#   dtypes    : the dtypes of the input and output arrays (to find unwanted promotions)
+#
+# A summary per function and the call at which the overall peak memory occurred are printed
+# when the script has finished.
+#
+# Args:
+#        script (required)   : The reconstruction script to run (e.g. simple_recon.py)
+#        json (optional)     : When given, all recorded calls are stored in this json file
+#        script_args         : All remaining arguments are passed to the script
+#
+# Example:
+#
+#   python memtrace.py --json memtrace.json simple_recon.py my_rawfile.raw
+#
+# The trace can also be used from within a script:
+#
+#   from memtrace import MemoryTrace
+#   with MemoryTrace() as trace:
+#       ...
+#   trace.print_summary()
+#
+# Note: tracing slows down the reconstruction. Only the outermost pr.* calls are recorded
+# (calls of pr.* functions within a pr.* function are part of the outer call). The peak
+# memory per call needs Python 3.9 or newer (tracemalloc.reset_peak), with older versions
+# the peak is the peak since the start of the trace.
+
+import argparse
+import functools
+import json
+import runpy
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from instrument import restore_functions, wrap_functions
+
+
+def _arrays(values):
+    # all numpy arrays in the arguments or results (also in tuples and lists)
+    for value in values:
+        if isinstance(value, np.ndarray):
+            yield value
+        elif isinstance(value, (tuple, list)):
+            yield from _arrays(value)
+
+
+def _format_bytes(nbytes):
+    return f'{nbytes / 1e6:10.1f} MB'
+
+
+class MemoryTrace:
+    """Records the allocated memory, the peak memory, copies and dtype changes of every pr.* call."""
+
+    def __init__(self):
+        self.calls = []
+        self._originals = dict()
+        self._depth = 0
+        self._started_tracemalloc = False
+
+    def __enter__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._originals.update(wrap_functions(self._wrap))
+        return self
+
+    def __exit__(self, *exc):
+        restore_functions(self._originals)
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def _wrap(self, name, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if self._depth:
+                return func(*args, **kwargs)
+
+            inputs = list(_arrays((*args, *kwargs.values())))
+            before, _ = tracemalloc.get_traced_memory()
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            start = time.perf_counter()
+            self._depth += 1
+            try:
+                out = func(*args, **kwargs)
+            finally:
+                self._depth -= 1
+            elapsed = time.perf_counter() - start
+            after, peak = tracemalloc.get_traced_memory()
+
+            outputs = list(_arrays(out if isinstance(out, tuple) else (out,)))
+            self.calls.append({
+                'index': len(self.calls),
+                'function': name,
+                'time': elapsed,
+                'allocated': after - before,
+                'peak': peak - before,
+                'absolute_peak': peak,
+                'output_bytes': sum(o.nbytes for o in outputs),
+                'copy': [not any(np.may_share_memory(o, i) for i in inputs) for o in outputs],
+                'input_dtypes': sorted({str(i.dtype) for i in inputs}),
+                'output_dtypes': sorted({str(o.dtype) for o in outputs}),
+            })
+            return out
+
+        return wrapper
+
+    def summary(self):
+        functions = dict()
+        for call in self.calls:
+            f = functions.setdefault(call['function'], {'calls': 0, 'time': 0.0, 'allocated': 0, 'peak': 0, 'copies': 0,
+                                                        'views': 0, 'dtype_changes': set()})
+            f['calls'] += 1
+            f['time'] += call['time']
+            f['allocated'] += call['allocated']
+            f['peak'] = max(f['peak'], call['peak'])
+            f['copies'] += sum(call['copy'])
+            f['views'] += len(call['copy']) - sum(call['copy'])
+            if call['input_dtypes'] and call['output_dtypes'] and call['input_dtypes'] != call['output_dtypes']:
+                f['dtype_changes'].add(f'{",".join(call["input_dtypes"])} -> {",".join(call["output_dtypes"])}')
+        return functions
+
+    def print_summary(self):
+        if not self.calls:
+            print('no precon functions were called')
+            return
+
+        print(f'{"function":<28} {"calls":>6} {"time":>9} {"allocated":>13} {"max peak":>13} {"copies":>7} {"views":>6}  dtype changes')
+        for name, f in sorted(self.summary().items(), key=lambda item: -item[1]['peak']):
+            print(f'{name:<28} {f["calls"]:>6} {f["time"]:>8.2f}s {_format_bytes(f["allocated"])} {_format_bytes(f["peak"])} '
+                  f'{f["copies"]:>7} {f["views"]:>6}  {"; ".join(sorted(f["dtype_changes"]))}')
+
+        call = max(self.calls, key=lambda c: c['absolute_peak'])
+        print(f'overall peak: {_format_bytes(call["absolute_peak"]).strip()} in call {call["index"]} (pr.{call["function"]})')
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.calls, f, indent=1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='run a recon with memory tracing')
+    parser.add_argument('--json', default=None, help='store all recorded calls in this json file')
+    parser.add_argument('script', help='the reconstruction script')
+    parser.add_argument('script_args', nargs=argparse.REMAINDER, help='the arguments passed to the script')
+    args = parser.parse_args()
+
+    sys.argv = [args.script] + args.script_args
+    with MemoryTrace() as trace:
+        try:
+            runpy.run_path(args.script, run_name='__main__')
+        finally:
+            trace.print_summary()
+            if args.json:
+                trace.save(args.json)
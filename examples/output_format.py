@@ -0,0 +1,72 @@
+# ----------------------------------------------------------------------------------------
+# output_format
+# ----------------------------------------------------------------------------------------
+# The last steps of every reconstruction (removing the oversampling along y and z, the
+# transformation into the radiological convention and making the image square) only
+# reposition pixels, but every step makes a full copy of the data:
+#
+#   data = pr.crop(data, axis=(1, 2), factor=(yovs, zovs), where='symmetric')
+#   data = pr.format(data, pars.get_in_plane_transformation(mix=mix, stack=stack))
+#   res = max(data.shape[0], data.shape[1])
+#   data = pr.zeropad(data, (res, res), axis=(0, 1))
+#
+# The OutputFormatter performs these steps in one pass. The combined index mapping is computed
+# once per image size by applying the three steps to an array which contains the pixel
+# indices, and the final image is written directly into an output array given by the caller
+# (e.g. a slice of the final series):
+#
+#   formatter = OutputFormatter(yovs, zovs, pars.get_in_plane_transformation(mix=mix, stack=stack))
+#   series = np.zeros(formatter.output_shape(data.shape), ...)
+#   formatter.apply(data, out=series[:, :, :, :, i:i + 1, ...])  # dynamic i
+#
+# Note: the output array must be a view (basic slicing), e.g. series[:, :, :, :, [i], ...]
+# would write into a copy.
+
+import numpy as np
+
+import precon as pr
+
+
+class OutputFormatter:
+    """Removes the oversampling, transforms the images into the radiological convention and makes them square in one pass."""
+
+    def __init__(self, yovs, zovs, in_plane_transformation):
+        self.yovs = yovs
+        self.zovs = zovs
+        self.in_plane_transformation = in_plane_transformation
+        self._maps = dict()
+
+    def _index_map(self, shape, ndim):
+        # the index mapping for images with the given size along x, y and z (and the given number of data dimensions)
+        if (shape, ndim) not in self._maps:
+            # the pixel indices start at 1 such that the zero padding can be identified
+            index = np.arange(1, np.prod(shape) + 1, dtype=np.float64)
+            index = index.reshape(shape + (1,) * (ndim - len(shape)), order='F')
+            index = pr.crop(index, axis=(1, 2), factor=(self.yovs, self.zovs), where='symmetric')
+            index = pr.format(index, self.in_plane_transformation)
+            res = max(index.shape[0], index.shape[1])
+            index = pr.zeropad(index, (res, res), axis=(0, 1))
+
+            index = np.real(index).reshape(index.shape[:3], order='F')
+            if not np.array_equal(index, np.rint(index)):
+                raise ValueError('the output format is not a repositioning of pixels')
+            index = index.astype(np.int64)
+            valid = index > 0
+            source = np.unravel_index(index[valid] - 1, shape, order='F')
+            self._maps[shape, ndim] = (index.shape, np.nonzero(valid), source, np.nonzero(~valid))
+        return self._maps[shape, ndim]
+
+    def output_shape(self, shape):
+        return self._index_map(tuple(shape[:3]), len(shape))[0] + tuple(shape[3:])
+
+    def apply(self, data, out=None):
+        out_shape, target, source, padding = self._index_map(data.shape[:3], data.ndim)
+        out_shape = out_shape + data.shape[3:]
+        if out is None:
+            out = np.empty(out_shape, dtype=data.dtype, order='F')
+        elif out.shape != out_shape:
+            raise ValueError(f'the output array has the wrong shape: {out.shape} (expected {out_shape})')
+
+        out[target] = data[source]
+        out[padding] = 0
+        return out
@@ -0,0 +1,128 @@
+# ----------------------------------------------------------------------------------------
+# precision
+# ----------------------------------------------------------------------------------------
+# Runs a reconstruction script with a global precision policy for the precon functions which
+# process images or k-space (see CAST_FUNCTIONS). Every array returned by one of these
+# functions is cast to the selected precision (single: float32/complex64, double:
+# float64/complex128) such that a whole pipeline stays in the same precision. The other
+# functions (e.g. the EPI correction parameters or the array compression matrix) are not
+# changed. In debug mode a warning is issued whenever a function returns an array with a
+# higher precision than its inputs.
+#
+# Note: the result is cast after the stage has returned. A stage which promotes an array
+# still allocates the promoted array and the cast makes another copy, hence the policy keeps
+# the following stages in the selected precision but does not reduce the peak memory of the
+# promoting stage itself. Arrays which are already in the selected precision are not copied.
+#
+# Args:
+#        script (required)   : The reconstruction script to run (e.g. epi_recon.py)
+#        precision (optional): The precision policy ('single' or 'double')
+#        warn (optional)     : When given a warning is issued whenever a stage promotes an array
+#        script_args         : All remaining arguments are passed to the script
+#
+# Example:
+#
+#   python precision.py --precision single --warn epi_recon.py my_rawfile.raw --refscan my_refscan.raw
+#
+# The policy can also be enabled from within a script:
+#
+#   import precon as pr
+#   from precision import set_precision
+#   set_precision('single', warn=True)
+
+import argparse
+import functools
+import runpy
+import sys
+import warnings
+
+import numpy as np
+
+from instrument import restore_functions, wrap_functions
+
+PRECISIONS = {
+    'single': (np.dtype(np.float32), np.dtype(np.complex64)),
+    'double': (np.dtype(np.float64), np.dtype(np.complex128)),
+}
+
+# the pr.* functions which return images or k-space (the labels returned by pr.read and pr.sort are not cast)
+CAST_FUNCTIONS = (
+    'read', 'sort', 'k2i', 'i2k', 'hamming_filter', 'homodyne', 'sense_unfold', 'sos', 'geo_corr', 'crop', 'format',
+    'zeropad', 'epi_corr', 'concomitant_field_correction', 'divide_flow_segments', 'fit_flow_phase', 'format_flow',
+    'retro_fill_holes', 'spectro_downsample', 'spectro_combine_coils',
+)
+
+# the original (unwrapped) precon functions
+_originals = dict()
+
+
+class PrecisionWarning(UserWarning):
+    pass
+
+
+def _is_float(x):
+    return isinstance(x, np.ndarray) and x.dtype.kind in 'fc'
+
+
+def _bits(dtype):
+    # the precision of the real part, i.e. 32 for float32 and complex64
+    return np.finfo(dtype).bits
+
+
+def _cast(name, out, input_dtypes, precision, warn, stacklevel=3):
+    # the stacklevel points to the caller of the pr.* function (one more level for every nested tuple)
+    if isinstance(out, tuple):
+        # (a loop instead of a generator expression, which would add another frame)
+        result = []
+        for o in out:
+            result.append(_cast(name, o, input_dtypes, precision, warn, stacklevel=stacklevel + 1))
+        return tuple(result)
+    if not _is_float(out):
+        return out
+
+    if warn and input_dtypes and _bits(out.dtype) > max(_bits(d) for d in input_dtypes):
+        inputs = ', '.join(sorted({str(d) for d in input_dtypes}))
+        warnings.warn(f'pr.{name} promoted {inputs} to {out.dtype}', PrecisionWarning, stacklevel=stacklevel)
+
+    real, cplx = PRECISIONS[precision]
+    return out.astype(cplx if out.dtype.kind == 'c' else real, copy=False)
+
+
+def _wrap(name, func, precision, warn):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        input_dtypes = [a.dtype for a in (*args, *kwargs.values()) if _is_float(a)]
+        out = func(*args, **kwargs)
+        return _cast(name, out, input_dtypes, precision, warn)
+
+    return wrapper
+
+
+def set_precision(precision, warn=False):
+    """Sets the precision policy for the pr.* functions in CAST_FUNCTIONS. Use precision=None to restore the default."""
+    if precision is not None and precision not in PRECISIONS:
+        raise ValueError(f'unknown precision: {precision} (must be one of {", ".join(PRECISIONS)})')
+
+    # restore the original functions first such that the policy can be changed
+    restore_functions(_originals)
+    if precision is None:
+        return
+
+    _originals.update(wrap_functions(lambda name, func: _wrap(name, func, precision, warn), names=CAST_FUNCTIONS))
+
+    if warn:
+        warnings.simplefilter('always', PrecisionWarning)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='run a recon with a precision policy')
+    parser.add_argument('--precision', default='single', choices=list(PRECISIONS), help='the precision of all arrays')
+    parser.add_argument('--warn', action='store_true', help='warn whenever a stage promotes an array')
+    parser.add_argument('script', help='the reconstruction script')
+    parser.add_argument('script_args', nargs=argparse.REMAINDER, help='the arguments passed to the script')
+    args = parser.parse_args()
+
+    set_precision(args.precision, warn=args.warn)
+
+    sys.argv = [args.script] + args.script_args
+    runpy.run_path(args.script, run_name='__main__')
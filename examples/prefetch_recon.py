@@ -0,0 +1,150 @@
+# ----------------------------------------------------------------------------------------
+# prefetch_recon
+# ----------------------------------------------------------------------------------------
+# A simple cartesian reconstruction (see simple_recon.py) where the data of the next mix and
+# stack is read in a background thread while the current one is reconstructed. Hence, the
+# time needed to read the data (e.g. from a network storage) is hidden behind the
+# computation.
+#
+# Args:
+#        rawfile (required)    : The path to the Philips rawfile to be reconstructed
+#        output_path (optional): The output path where the results are stored
+#        prefetch (optional)   : The number of mixes/stacks which are read ahead (1 = double buffering)
+#
+# The prefetching reader can be used in any of the other examples by replacing the loops
+# over the mixes and stacks and the pr.read call with:
+#
+#   selections = [(mix, stack) for mix in parameter2read.mix for stack in parameter2read.stack]
+#   for mix, stack, data, labels in prefetch_read(pars, selections):
+#       ...
+
+import argparse
+import queue
+import threading
+from pathlib import Path
+
+import numpy as np
+from scipy.io import savemat
+
+import precon as pr
+
+# marks the end of the data in the prefetch queue
+_DONE = object()
+
+
+def prefetch_read(pars, selections, depth=1, **read_kwargs):
+    """Yields (mix, stack, data, labels) for every (mix, stack) selection while the next ones are read in a background thread."""
+    if depth < 1:
+        # a queue without a maximum size would read all selections ahead
+        raise ValueError(f'the prefetch depth must be at least 1 (got {depth})')
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        # waits for a free slot in the buffer unless the consumer has stopped
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def reader():
+        try:
+            parameter2read = pr.Parameter2Read(pars.labels)
+            with open(pars.rawfile, 'rb') as raw:
+                for mix, stack in selections:
+                    if stop.is_set():
+                        return
+                    parameter2read.mix = mix
+                    parameter2read.stack = stack
+                    data, labels = pr.read(raw, parameter2read, pars.labels, pars.coil_info, **read_kwargs)
+                    put((mix, stack, data, labels))
+            put(_DONE)
+        except BaseException as e:
+            put(e)
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='prefetch recon')
+    parser.add_argument('rawfile', help='path to the raw or lab file')
+    parser.add_argument('--output-path', default='./', help='path where the output is saved')
+    parser.add_argument('--prefetch', type=int, default=1, help='the number of mixes/stacks which are read ahead')
+    args = parser.parse_args()
+    if args.prefetch < 1:
+        parser.error('--prefetch must be at least 1')
+
+    # read parameter
+    pars = pr.Parameter(Path(args.rawfile))
+
+    # define what to read
+    parameter2read = pr.Parameter2Read(pars.labels)
+
+    # enable performance logging (reconstruction times)
+    pars.performance_logging = True
+
+    # open the matlab file such that the results can be appended as soon as a mix and stack is reconstructed
+    with open(Path(args.output_path) / 'data.mat', 'wb') as mat_file:
+        # reconstruct every mix and stack seperately (the next mix and stack is read while the current one is reconstructed)
+        selections = [(mix, stack) for mix in parameter2read.mix for stack in parameter2read.stack]
+        for mix, stack, data, labels in prefetch_read(pars, selections, depth=args.prefetch):
+            # sort and zero fill data (create k-space)
+            cur_recon_resolution = pars.get_recon_resolution(mix=mix, xovs=False, yovs=True, zovs=True)
+            data, labels = pr.sort(data, labels, output_size=cur_recon_resolution)
+
+            # FFT
+            data = pr.k2i(data, axis=(0, 1, 2))
+
+            # shift data in image space
+            yshift = pars.get_shift(enc=1, mix=mix, stack=stack)
+            zshift = pars.get_shift(enc=2, mix=mix, stack=stack)
+            if yshift:
+                data = np.roll(data, yshift, axis=1)
+            if zshift:
+                data = np.roll(data, zshift, axis=2)
+
+            # partial fourier reconstruction
+            kx_range = pars.get_range(enc=0, mix=mix, stack=stack, ovs=False)
+            ky_range = pars.get_range(enc=1, mix=mix, stack=stack)
+            kz_range = pars.get_range(enc=2, mix=mix, stack=stack)
+            if pr.is_partial_fourier(kx_range) or pr.is_partial_fourier(ky_range) or pr.is_partial_fourier(kz_range):
+                data = pr.homodyne(data, kx_range, ky_range, kz_range)
+
+            # combine coils with a sum-of squares combination
+            data = pr.sos(data, axis=3)
+
+            # perform geometry correction
+            r, gys, gxc, gz = pars.get_geo_corr_pars()
+            locations = pr.utils.get_unique(labels, 'loca')
+            MPS_to_XYZ = pars.get_transformation_matrix(loca=locations, mix=mix, target=pr.Enums.XYZ)
+            voxel_sizes = pars.get_voxel_sizes(mix=mix)
+            data = pr.geo_corr(data, MPS_to_XYZ, r, gys, gxc, gz, voxel_sizes=voxel_sizes)
+
+            # remove the oversampling
+            yovs = pars.get_oversampling(enc=1, mix=mix)
+            zovs = pars.get_oversampling(enc=2, mix=mix)
+            data = pr.crop(data, axis=(1, 2), factor=(yovs, zovs), where='symmetric')
+
+            # transform the images into the radiological convention
+            data = pr.format(data, pars.get_in_plane_transformation(mix=mix, stack=stack))
+
+            # make the image square
+            res = max(data.shape[0], data.shape[1])
+            data = pr.zeropad(data, (res, res), axis=(0, 1))
+
+            # append data to the .mat file
+            savemat(mat_file, {f'data_{mix}_{stack}': data})
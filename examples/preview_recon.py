@@ -0,0 +1,157 @@
+# ----------------------------------------------------------------------------------------
+# preview_recon
+# ----------------------------------------------------------------------------------------
+# A fast low resolution preview reconstruction for the triage of scans (e.g. in an ingest
+# pipeline before a full reconstruction is started). Only a central block of the k-space is
+# read from the rawfile (selected with Parameter2Read.ky/kz, see read_k0.py), and SENSE,
+# homodyne and the geometry correction are skipped. For every stack a thumbnail (montage of
+# the slices) and some basic QA metrics are stored.
+#
+# Args:
+#        rawfile (required)    : The path to the Philips rawfile
+#        output_path (optional): The output path where the thumbnails and the QA metrics (qa.json) are stored
+#        size (optional)       : The number of central ky (and kz) profiles which are read
+#        max-slices (optional) : The maximum number of slices in a thumbnail
+#
+# The following QA metrics are computed for every mix and stack:
+#
+#   max, mean        : the maximum and the mean of the preview images
+#   snr              : a rough SNR estimate (mean of the object / standard deviation of the background)
+#   nan_fraction     : the fraction of pixels which are not finite
+#   coil_signal_ratio: the signal of the weakest coil relative to the median of all coils (a small value
+#                      indicates a broken coil)
+#
+# Note: for SENSE scans the central k-space block is undersampled, hence the preview images
+# are folded. The first dynamic, cardiac phase, echo, ... is shown in the thumbnails.
+#
+# Requires: matplotlib
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+import precon as pr
+
+
+def central_profiles(k_range, size):
+    # the central profiles of a k-space range [min, max]
+    return list(range(max(k_range[0], -(size // 2)), min(k_range[1], (size - 1) // 2) + 1))
+
+
+def crop_center(data, size, axis):
+    start = (data.shape[axis] - size) // 2
+    return np.take(data, np.arange(start, start + size), axis=axis)
+
+
+def qa_metrics(images, kspace):
+    images = np.abs(images)
+    finite = np.isfinite(images)
+    values = images[finite]
+    reference = np.percentile(values, 99) if values.size else 0
+    signal = values[values > 0.2 * reference]
+    background = values[values <= 0.05 * reference]
+    noise = np.std(background) if background.size > 1 else 0
+
+    # the signal of every coil (maximum of the k-space which is close to k0)
+    coil_axes = tuple(i for i in range(kspace.ndim) if i != pr.Enums.CHANNEL_DIM)
+    coil_signal = np.max(np.abs(kspace), axis=coil_axes)
+    median = np.median(coil_signal)
+
+    return {
+        'max': float(values.max()) if values.size else 0.0,
+        'mean': float(values.mean()) if values.size else 0.0,
+        'snr': float(signal.mean() / noise) if noise > 0 and signal.size else None,
+        'nan_fraction': float(1 - finite.mean()),
+        'coil_signal_ratio': float(coil_signal.min() / median) if median > 0 else None,
+    }
+
+
+def save_thumbnail(images, filename, max_slices=16):
+    import matplotlib.image
+
+    # the slices are along z and the locations (the first of all other dimensions is shown)
+    index = [slice(None), slice(None), slice(None)] + [0] * (images.ndim - 3)
+    index[pr.Enums.LOCATION_DIM] = slice(None)
+    slices = np.abs(images[tuple(index)]).reshape(images.shape[0], images.shape[1], -1, order='F')
+    slices = slices[:, :, np.unique(np.linspace(0, slices.shape[2] - 1, max_slices).round().astype(int))]
+
+    # montage of the slices (the first dimension is displayed from top to bottom)
+    columns = int(np.ceil(np.sqrt(slices.shape[2])))
+    rows = int(np.ceil(slices.shape[2] / columns))
+    nx, ny = slices.shape[:2]
+    montage = np.zeros((rows * ny, columns * nx))
+    for i in range(slices.shape[2]):
+        r, c = divmod(i, columns)
+        montage[r * ny:(r + 1) * ny, c * nx:(c + 1) * nx] = slices[:, :, i].T
+
+    vmax = np.percentile(montage[np.isfinite(montage)], 99.5) if np.isfinite(montage).any() else 1
+    matplotlib.image.imsave(filename, np.nan_to_num(montage), cmap='gray', vmin=0, vmax=vmax or 1)
+
+
+parser = argparse.ArgumentParser(description='preview recon')
+parser.add_argument('rawfile', help='path to the raw or lab file')
+parser.add_argument('--output-path', default='./', help='path where the output is saved')
+parser.add_argument('--size', type=int, default=32, help='the number of central ky (and kz) profiles')
+parser.add_argument('--max-slices', type=int, default=16, help='the maximum number of slices in a thumbnail')
+args = parser.parse_args()
+
+start = time.perf_counter()
+
+# read parameter
+pars = pr.Parameter(Path(args.rawfile))
+
+# define what to read
+parameter2read = pr.Parameter2Read(pars.labels)
+
+qa = {'rawfile': str(args.rawfile), 'stacks': dict()}
+
+# reconstruct every mix and stack seperately
+for mix in parameter2read.mix:
+    for stack in parameter2read.stack:
+        parameter2read.stack = stack
+        parameter2read.mix = mix
+
+        # read only the central k-space block
+        ky = central_profiles(pars.get_range(enc=1, mix=mix, stack=stack), args.size)
+        kz = central_profiles(pars.get_range(enc=2, mix=mix, stack=stack), args.size)
+        parameter2read.ky = ky
+        parameter2read.kz = kz
+        with open(pars.rawfile, 'rb') as raw:
+            data, labels = pr.read(raw, parameter2read, pars.labels, pars.coil_info)
+
+        # sort the data into a small k-space (the central block is zero filled when it is asymmetric)
+        recon_resolution = pars.get_recon_resolution(mix=mix, xovs=False, yovs=True, zovs=True)
+        ny = args.size if len(ky) > 1 else 1
+        nz = args.size if len(kz) > 1 else 1
+        data, labels = pr.sort(data, labels, output_size=[recon_resolution[0], ny, nz])
+
+        # keep the same resolution reduction along the readout direction
+        nx = max(1, min(data.shape[0], round(data.shape[0] * ny / recon_resolution[1])))
+        data = crop_center(data, nx, axis=0)
+        kspace = data
+
+        # FFT and sum-of-squares coil combination
+        data = pr.k2i(data, axis=(0, 1, 2))
+        data = pr.sos(data, axis=3)
+
+        # remove the oversampling and transform the images into the radiological convention
+        yovs = pars.get_oversampling(enc=1, mix=mix)
+        zovs = pars.get_oversampling(enc=2, mix=mix)
+        data = pr.crop(data, axis=(1, 2), factor=(yovs, zovs), where='symmetric')
+        data = pr.format(data, pars.get_in_plane_transformation(mix=mix, stack=stack))
+
+        # thumbnail and QA metrics
+        thumbnail = Path(args.output_path) / f'preview_{mix}_{stack}.png'
+        save_thumbnail(data, thumbnail, max_slices=args.max_slices)
+        qa['stacks'][f'{mix}_{stack}'] = {'size': list(data.shape[:3]), 'thumbnail': thumbnail.name, **qa_metrics(data, kspace)}
+
+qa['time'] = time.perf_counter() - start
+with open(Path(args.output_path) / 'qa.json', 'w') as f:
+    json.dump(qa, f, indent=1)
+
+for key, metrics in qa['stacks'].items():
+    print(f'{key}: size {metrics["size"]}, snr {metrics["snr"]}, coil signal ratio {metrics["coil_signal_ratio"]}')
+print(f'preview done in {qa["time"]:.2f}s')
@@ -0,0 +1,155 @@
+# ----------------------------------------------------------------------------------------
+# realtime_recon
+# ----------------------------------------------------------------------------------------
+# An incremental reconstruction of a rawfile which is still being written (e.g. during an
+# exam). The rawfile is followed while it grows and the images of every dynamic are
+# reconstructed as soon as all of its profiles are available. Hence, the latency of the
+# images follows the acquisition instead of acquisition plus reconstruction time. The same
+# steps as in simple_recon.py are performed for every dynamic.
+#
+# Args:
+#        rawfile (required)      : The path to the Philips rawfile to be reconstructed
+#        output_path (optional)  : The output path where the results are stored
+#        timeout (optional)      : The recon fails when the rawfile is incomplete and did not grow for this many seconds
+#        poll-interval (optional): The interval in seconds in which the rawfile is checked for new data
+#
+# The labels (.lab file) must be complete when the recon is started. A dynamic is complete as
+# soon as the rawfile contains the last of its profiles (offset and size of the labels), hence
+# the rawfile is only read once per dynamic, mix and stack. The bundled data can be used for
+# testing with replay_raw.py, which writes a rawfile slowly.
+#
+# The reconstruction performed in this file consists of the following steps:
+#
+#   1. Read the parameters from the rawfile
+#   2. Loop over all dynamics, mixes and stacks (in the order of the acquisition)
+#   3. Wait until all profiles of the current dynamic, mix and stack are written
+#   4. Reconstruct the images (same steps as in simple_recon.py)
+#   5. Append the images to the .mat file
+
+import argparse
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+from scipy.io import savemat
+
+import precon as pr
+from label_array import labels_to_array
+
+
+def data_ends(labels, types):
+    # the end of the last profile in the rawfile for every dynamic and mix (the stack is not a label, hence the
+    # profiles of all stacks of a dynamic and mix are needed)
+    table = labels_to_array(labels)
+    table = table[np.isin(table['typ'], types)]
+    ends = table['offset'].astype(np.int64) + table['size']
+    keys, inverse = np.unique(np.stack([table['dyn'], table['mix']], axis=1), axis=0, return_inverse=True)
+    max_ends = np.zeros(len(keys), dtype=np.int64)
+    np.maximum.at(max_ends, inverse.ravel(), ends)
+    return {(int(dyn), int(mix)): int(end) for (dyn, mix), end in zip(keys, max_ends)}
+
+
+def wait_for_data(rawfile, end, timeout, poll_interval):
+    # waits until the rawfile contains all bytes up to end, fails when the file did not grow for timeout seconds
+    size, last_change = -1, time.perf_counter()
+    while True:
+        cur_size = os.path.getsize(rawfile)
+        if cur_size >= end:
+            return
+        if cur_size != size:
+            size, last_change = cur_size, time.perf_counter()
+        elif time.perf_counter() - last_change > timeout:
+            raise RuntimeError(f'the rawfile did not grow for {timeout}s and is incomplete ({cur_size} of {end} bytes)')
+        time.sleep(poll_interval)
+
+
+parser = argparse.ArgumentParser(description='realtime recon')
+parser.add_argument('rawfile', help='path to the raw or lab file')
+parser.add_argument('--output-path', default='./', help='path where the output is saved')
+parser.add_argument('--timeout', type=float, default=10, help='fail when the incomplete rawfile did not grow for this time (s)')
+parser.add_argument('--poll-interval', type=float, default=0.2, help='the poll interval of the rawfile in seconds')
+args = parser.parse_args()
+
+# read parameter
+pars = pr.Parameter(Path(args.rawfile))
+
+# define what to read
+parameter2read = pr.Parameter2Read(pars.labels)
+dynamics = parameter2read.dyn
+mixes = parameter2read.mix
+stacks = parameter2read.stack
+
+# open the matlab file such that the results can be appended as soon as a dynamic is reconstructed
+with open(Path(args.output_path) / 'data.mat', 'wb') as mat_file:
+    # the profiles of a dynamic are complete as soon as the rawfile contains the last of them (according to the labels)
+    ends = data_ends(pars.labels, parameter2read.typ)
+
+    start = time.perf_counter()
+
+    # reconstruct the dynamics in the order of the acquisition
+    for dyn in dynamics:
+        for mix in mixes:
+            for stack in stacks:
+                parameter2read.dyn = dyn
+                parameter2read.mix = mix
+                parameter2read.stack = stack
+
+                # wait until all profiles of the current selection are written
+                if (dyn, mix) not in ends:
+                    # the selection does not contain any data
+                    continue
+                wait_for_data(pars.rawfile, ends[(dyn, mix)], args.timeout, args.poll_interval)
+
+                # read data
+                with open(pars.rawfile, 'rb') as raw:
+                    data, labels = pr.read(raw, parameter2read, pars.labels, pars.coil_info)
+
+                # sort and zero fill data (create k-space)
+                cur_recon_resolution = pars.get_recon_resolution(mix=mix, xovs=False, yovs=True, zovs=True)
+                data, labels = pr.sort(data, labels, output_size=cur_recon_resolution)
+
+                # FFT
+                data = pr.k2i(data, axis=(0, 1, 2))
+
+                # shift data in image space
+                yshift = pars.get_shift(enc=1, mix=mix, stack=stack)
+                zshift = pars.get_shift(enc=2, mix=mix, stack=stack)
+                if yshift:
+                    data = np.roll(data, yshift, axis=1)
+                if zshift:
+                    data = np.roll(data, zshift, axis=2)
+
+                # partial fourier reconstruction
+                kx_range = pars.get_range(enc=0, mix=mix, stack=stack, ovs=False)
+                ky_range = pars.get_range(enc=1, mix=mix, stack=stack)
+                kz_range = pars.get_range(enc=2, mix=mix, stack=stack)
+                if pr.is_partial_fourier(kx_range) or pr.is_partial_fourier(ky_range) or pr.is_partial_fourier(kz_range):
+                    data = pr.homodyne(data, kx_range, ky_range, kz_range)
+
+                # combine coils with a sum-of squares combination
+                data = pr.sos(data, axis=3)
+
+                # perform geometry correction
+                r, gys, gxc, gz = pars.get_geo_corr_pars()
+                locations = pr.utils.get_unique(labels, 'loca')
+                MPS_to_XYZ = pars.get_transformation_matrix(loca=locations, mix=mix, target=pr.Enums.XYZ)
+                voxel_sizes = pars.get_voxel_sizes(mix=mix)
+                data = pr.geo_corr(data, MPS_to_XYZ, r, gys, gxc, gz, voxel_sizes=voxel_sizes)
+
+                # remove the oversampling
+                yovs = pars.get_oversampling(enc=1, mix=mix)
+                zovs = pars.get_oversampling(enc=2, mix=mix)
+                data = pr.crop(data, axis=(1, 2), factor=(yovs, zovs), where='symmetric')
+
+                # transform the images into the radiological convention
+                data = pr.format(data, pars.get_in_plane_transformation(mix=mix, stack=stack))
+
+                # make the image square
+                res = max(data.shape[0], data.shape[1])
+                data = pr.zeropad(data, (res, res), axis=(0, 1))
+
+                # append data to the .mat file
+                savemat(mat_file, {f'data_{dyn}_{mix}_{stack}': data})
+                mat_file.flush()
+                print(f'dynamic {dyn}, mix {mix}, stack {stack} reconstructed after {time.perf_counter() - start:.1f}s')
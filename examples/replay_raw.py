@@ -0,0 +1,52 @@
+# ----------------------------------------------------------------------------------------
+# replay_raw
+# ----------------------------------------------------------------------------------------
+# Simulates an ongoing acquisition by slowly copying a Philips rawfile into an output folder.
+# The .lab and .sin files are copied first and the .raw file is then written in small blocks
+# with a given data rate. Together with realtime_recon.py this can be used to test the
+# reconstruction of a rawfile which is still being written.
+#
+# Args:
+#        rawfile (required)    : The path to the Philips rawfile to be replayed
+#        output_path (required): The output folder into which the rawfile is written
+#        duration (optional)   : The duration of the replay in seconds
+#        block-size (optional) : The number of bytes written at once
+#
+# Example (in two terminals):
+#
+#   python replay_raw.py my_rawfile.raw /tmp/scanner --duration 30
+#   python realtime_recon.py /tmp/scanner/my_rawfile.raw
+
+import argparse
+import shutil
+import time
+from pathlib import Path
+
+parser = argparse.ArgumentParser(description='replay a rawfile')
+parser.add_argument('rawfile', help='path to the raw file')
+parser.add_argument('output_path', help='the folder into which the rawfile is written')
+parser.add_argument('--duration', type=float, default=30, help='the duration of the replay in seconds')
+parser.add_argument('--block-size', type=int, default=64 * 1024, help='the number of bytes written at once')
+args = parser.parse_args()
+
+rawfile = Path(args.rawfile)
+output_path = Path(args.output_path)
+output_path.mkdir(parents=True, exist_ok=True)
+
+# the labels and the parameters must be available before the recon starts
+for extension in ('.lab', '.sin'):
+    file = rawfile.with_suffix(extension)
+    if file.exists():
+        shutil.copy(file, output_path / file.name)
+
+# write the raw data block by block
+size = rawfile.stat().st_size
+nr_blocks = -(-size // args.block_size)
+delay = args.duration / nr_blocks
+with open(rawfile, 'rb') as src, open(output_path / rawfile.name, 'wb') as dst:
+    for i in range(nr_blocks):
+        dst.write(src.read(args.block_size))
+        dst.flush()
+        print(f'\rwritten {min((i + 1) * args.block_size, size)} / {size} bytes', end='')
+        time.sleep(delay)
+print()
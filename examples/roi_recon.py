@@ -0,0 +1,195 @@
+# ----------------------------------------------------------------------------------------
+# roi_recon
+# ----------------------------------------------------------------------------------------
+# A cartesian reconstruction (with optional SENSE) of a region of interest. Only the
+# requested locations (slices) are read from the rawfile and only the requested range along
+# the readout direction is kept. Without the geometry correction, the readout ROI is applied
+# after the FFT along the readout (the data is separable in hybrid space, i.e. every readout
+# position can be reconstructed independently). Hence, the computation time and the memory
+# are proportional to the size of the ROI.
+#
+# Args:
+#        rawfile (required)    : The path to the Philips rawfile to be reconstructed
+#        refscan (optional)    : The path to the Philips SENSE reference scan
+#        output_path (optional): The output path where the results are stored
+#        locations (optional)  : The locations (slices) which are reconstructed (default: all)
+#        x-range (optional)    : The first and the last pixel along the readout direction which are reconstructed
+#                                (in the recon resolution without oversampling, default: all)
+#        no-geo-corr (optional): When given, the geometry correction is skipped (the readout ROI is then applied in
+#                                hybrid space)
+#
+# The reconstruction performed in this file consists of the following steps:
+#
+#   1. Read the parameters from the rawfile
+#   2. Reconstruct the SENSE reference scan (when given)
+#   3. Create a Parameter2Read class which reads only the requested locations
+#   4. Loop over all mixes and stacks
+#   5. Reformat the SENSE reference scan into the geometry of the target scan and crop it to the readout ROI
+#   6. Read the data from the current mix and stack
+#   7. Sort and zero-fill the data according to the labels (create k-space)
+#   8. Perform fourier transformation along the readout direction and crop the data to the readout ROI (only without
+#      geometry correction)
+#   9. Perform fourier transformation along the phase encoding directions
+#  10. Shift the images such that they are aligned correctly
+#  11. Perform a SENSE reconstruction (unfolding) when a reference scan is given
+#  12. Perform a partial fourier (homodyne) reconstruction when halfscan or partial echo was enabled
+#  13. Combine the coils with a sum-of-squares combination (without SENSE)
+#  14. Perform the geometry correction and crop the data to the readout ROI (when it has not been cropped yet)
+#  15. Remove the oversampling along the phase encoding directions
+#  16. Transform the images into the radiological convention
+#  17. Make the images square (only without readout ROI)
+#
+# Note: the geometry correction needs the whole readout (it moves the pixels along all
+# directions), and so does the homodyne reconstruction with partial echo. In these cases the
+# readout ROI is applied after the geometry correction and only the remaining steps are
+# faster. The locations cannot be combined with a SENSE reconstruction since the
+# sensitivities are computed for the whole stack.
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+from scipy.io import savemat
+
+import precon as pr
+from sensitivity_maps import map_sensitivity
+
+
+def crop_x(data, x_range):
+    # crops the data along the readout direction (the copy releases the memory of the full data)
+    return np.asfortranarray(data[x_range[0]:x_range[1] + 1])
+
+
+def crop_sensitivity(sens, x_range):
+    # returns a copy of the sensitivities which is cropped to the readout ROI
+    return map_sensitivity(sens, lambda value: crop_x(value, x_range))
+
+
+parser = argparse.ArgumentParser(description='roi recon')
+parser.add_argument('rawfile', help='path to the raw or lab file')
+parser.add_argument('--refscan', default=None, help='path to the sense reference scan')
+parser.add_argument('--output-path', default='./', help='path where the output is saved')
+parser.add_argument('--locations', nargs='+', type=int, default=None, help='the locations which are reconstructed')
+parser.add_argument('--x-range', nargs=2, type=int, default=None, metavar=('FIRST', 'LAST'),
+                    help='the first and the last pixel along the readout direction')
+parser.add_argument('--no-geo-corr', action='store_true', help='skip the geometry correction')
+args = parser.parse_args()
+
+if args.locations and args.refscan:
+    parser.error('--locations cannot be combined with a SENSE reconstruction')
+if args.x_range and not 0 <= args.x_range[0] <= args.x_range[1]:
+    parser.error(f'invalid --x-range {args.x_range[0]} {args.x_range[1]} (FIRST must be >= 0 and <= LAST)')
+
+# read parameter
+pars = pr.Parameter(Path(args.rawfile))
+
+if args.refscan:
+    # reconstruct refscan
+    ref_pars = pr.Parameter(Path(args.refscan))
+    qbc, coil = pr.reconstruct_refscan(ref_pars)
+
+# define what to read (only the requested locations)
+parameter2read = pr.Parameter2Read(pars.labels)
+if args.locations:
+    parameter2read.loca = args.locations
+
+# the readout ROI must be within the recon resolution (without oversampling) of all mixes
+if args.x_range:
+    for mix in parameter2read.mix:
+        nx = pars.get_recon_resolution(mix=mix, xovs=False, yovs=True, zovs=True)[0]
+        if args.x_range[1] >= nx:
+            parser.error(f'--x-range {args.x_range[0]} {args.x_range[1]} is outside the readout of mix {mix} (0 - {nx - 1})')
+
+# enable performance logging (reconstruction times)
+pars.performance_logging = True
+
+# open the matlab file such that the results can be appended as soon as a mix and stack is reconstructed
+with open(Path(args.output_path) / 'data.mat', 'wb') as mat_file:
+    # reconstruct every mix and stack seperately
+    for mix in parameter2read.mix:
+        for stack in parameter2read.stack:
+            parameter2read.stack = stack
+            parameter2read.mix = mix
+
+            # the readout ROI is applied after the geometry correction and the homodyne reconstruction for partial echo
+            kx_range = pars.get_range(enc=0, mix=mix, stack=stack, ovs=False)
+            ky_range = pars.get_range(enc=1, mix=mix, stack=stack)
+            kz_range = pars.get_range(enc=2, mix=mix, stack=stack)
+            x_roi_in_hybrid_space = args.x_range and args.no_geo_corr and not pr.is_partial_fourier(kx_range)
+
+            sens = None
+            if args.refscan:
+                # calculate the sensitivities
+                sens = pr.reformat_refscan(qbc, coil, ref_pars, pars, stack=stack, mix=mix, match_target_size=True)
+                if x_roi_in_hybrid_space:
+                    sens = crop_sensitivity(sens, args.x_range)
+
+            # read data
+            with open(pars.rawfile, 'rb') as raw:
+                data, labels = pr.read(raw, parameter2read, pars.labels, pars.coil_info)
+            if data is None or data.size == 0:
+                # the stack does not contain any of the requested locations
+                continue
+
+            # sort and zero fill data (create k-space)
+            cur_recon_resolution = pars.get_recon_resolution(mix=mix, xovs=False, yovs=True, zovs=True, folded=sens is not None)
+            data, labels = pr.sort(data, labels, output_size=cur_recon_resolution)
+
+            # FFT along the readout direction and crop to the readout ROI (hybrid space)
+            data = pr.k2i(data, axis=0)
+            if x_roi_in_hybrid_space:
+                data = crop_x(data, args.x_range)
+
+            # FFT along the phase encoding directions
+            data = pr.k2i(data, axis=(1, 2))
+
+            # shift data in image space
+            yshift = pars.get_shift(enc=1, mix=mix, stack=stack)
+            zshift = pars.get_shift(enc=2, mix=mix, stack=stack)
+            if yshift:
+                data = np.roll(data, yshift, axis=1)
+            if zshift:
+                data = np.roll(data, zshift, axis=2)
+
+            # SENSE unfolding
+            if sens is not None:
+                regularization_factor = pars.get_value(pars.SENSE_REGULARIZATION_FACTOR, at=0, default=2)
+                output_size = list(pars.get_recon_resolution(mix=mix, xovs=False, yovs=True, zovs=True, folded=False))
+                output_size[0] = data.shape[0]
+                data = pr.sense_unfold(data, sens, output_size, regularization_factor=regularization_factor)
+
+            # partial fourier reconstruction
+            if pr.is_partial_fourier(kx_range) or pr.is_partial_fourier(ky_range) or pr.is_partial_fourier(kz_range):
+                data = pr.homodyne(data, kx_range, ky_range, kz_range)
+
+            # combine coils with a sum-of squares combination
+            if sens is None:
+                data = pr.sos(data, axis=3)
+
+            # perform geometry correction (on the whole readout)
+            if not args.no_geo_corr:
+                r, gys, gxc, gz = pars.get_geo_corr_pars()
+                locations = pr.utils.get_unique(labels, 'loca')
+                MPS_to_XYZ = pars.get_transformation_matrix(loca=locations, mix=mix, target=pr.Enums.XYZ)
+                voxel_sizes = pars.get_voxel_sizes(mix=mix)
+                data = pr.geo_corr(data, MPS_to_XYZ, r, gys, gxc, gz, voxel_sizes=voxel_sizes)
+
+            # crop to the readout ROI
+            if args.x_range and not x_roi_in_hybrid_space:
+                data = crop_x(data, args.x_range)
+
+            # remove the oversampling
+            yovs = pars.get_oversampling(enc=1, mix=mix)
+            zovs = pars.get_oversampling(enc=2, mix=mix)
+            data = pr.crop(data, axis=(1, 2), factor=(yovs, zovs), where='symmetric')
+
+            # transform the images into the radiological convention
+            data = pr.format(data, pars.get_in_plane_transformation(mix=mix, stack=stack))
+
+            # make the image square
+            if not args.x_range:
+                res = max(data.shape[0], data.shape[1])
+                data = pr.zeropad(data, (res, res), axis=(0, 1))
+
+            # append data to the .mat file
+            savemat(mat_file, {f'data_{mix}_{stack}': data})
@@ -0,0 +1,231 @@
+# ----------------------------------------------------------------------------------------
+# scan_index
+# ----------------------------------------------------------------------------------------
+# Builds a persistent index over a directory tree of Philips scans (.raw/.lab or .sin files)
+# and queries it. For every scan a lightweight summary (scan type, geometry, sizes and the
+# name of the SENSE reference scan) is extracted once. The index is updated incrementally,
+# i.e. only new or modified scans are parsed again. Hence, questions like "which flow scans
+# need refscan X" or "which recipe should be used for this scan" can be answered without
+# parsing the scans again.
+#
+# Usage:
+#
+#   create or update the index (the scans are parsed in parallel threads):
+#
+#       python scan_index.py update /data/exams --index exams.json --workers 8
+#
+#   query the index:
+#
+#       python scan_index.py query --index exams.json --type flow --refscan my_refscan.raw
+#
+# The scan type is one of: epi, flow, cardiac or normal. The recipe which can be used to
+# reconstruct a scan (see batch_recon.py) and its arguments (e.g. the path of the refscan,
+# which is searched in the folder of the scan) are stored with every scan. Scans which need
+# a refscan which cannot be found and sin files of scans without a sin recipe (epi and
+# retrospectively gated cardiac scans need the rawfile) are marked as not runnable. The
+# runnable scans of a query can be written into a batch_recon.py manifest:
+#
+#       python scan_index.py query --index exams.json --type flow --manifest flow_jobs.jsonl
+#       python batch_recon.py --manifest flow_jobs.jsonl
+
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from batch_recon import RECIPES, REFSCAN_RECIPES
+
+
+def to_json(value):
+    # converts numpy arrays and scalars such that they can be stored as json
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [to_json(v) for v in value]
+    return value
+
+
+def find_scans(folder):
+    # a scan is either a rawfile with labels or a sin file (when no rawfile with labels exists)
+    scans = []
+    for root, _, files in os.walk(folder):
+        stems = {Path(f).stem for f in files if f.endswith('.lab')}
+        for f in files:
+            path = Path(root) / f
+            if f.endswith('.raw') and path.stem in stems:
+                scans.append(path)
+            elif f.endswith('.sin') and path.stem not in stems:
+                scans.append(path)
+    return scans
+
+
+def summarize(scan):
+    import precon as pr
+
+    pars = pr.Parameter(scan)
+    parameter2read = pr.Parameter2Read(pars.labels)
+
+    # retrospectively gated scans are acquired without cardiac phase labels, the phases are binned in the recon
+    nr_phases = pars.get_nr_phases()
+    retrospective = nr_phases > 1 and len(pr.utils.get_unique(pars.labels, 'card')) == 1
+
+    if pars.is_epi():
+        scan_type = 'epi'
+    elif len(parameter2read.extr1) > 1:
+        scan_type = 'flow'
+    elif nr_phases > 1:
+        scan_type = 'cardiac'
+    else:
+        scan_type = 'normal'
+
+    sense_factors = pars.get_value(pars.SENSE_FACTORS, default=[1, 1, 1])
+    refscan = pars.get_value('coca_rc_file_names', default=[None])
+    refscan = refscan[0] if isinstance(refscan, list) else refscan
+    needs_refscan = any(float(f) > 1 for f in sense_factors)
+
+    # prospectively triggered cardiac scans are reconstructed like normal scans
+    if scan_type in ('epi', 'flow'):
+        recipe = scan_type
+    elif scan_type == 'cardiac' and retrospective:
+        recipe = 'cardiac_retro'
+    else:
+        recipe = 'sense' if needs_refscan else 'simple'
+    if scan.suffix == '.sin' and f'{recipe}_sin' in RECIPES:
+        recipe = f'{recipe}_sin'
+
+    # the arguments of the recipe (see batch_recon.py). The refscan is searched in the folder of the scan (as in the sin
+    # recipes), a scan which needs a refscan which cannot be found cannot be reconstructed.
+    refscan_path = scan.parent / refscan if refscan else None
+    refscan_found = refscan_path is not None and refscan_path.exists()
+    args = []
+    reason = None if refscan_found else 'refscan not found'
+    if recipe in REFSCAN_RECIPES:
+        args = [str(refscan_path)] if refscan_found else []
+    elif recipe == 'epi' and needs_refscan:
+        args = ['--refscan', str(refscan_path)] if refscan_found else []
+    elif recipe not in ('sense_sin', 'flow_sin'):
+        reason = None
+
+    # the recipe must be able to read the file of the scan (e.g. there is no sin recipe for epi scans)
+    extension = RECIPES[recipe][1]
+    if scan.suffix != extension:
+        reason = f'the recipe needs a {extension} file'
+    runnable = reason is None
+
+    return {
+        'type': scan_type,
+        'recipe': recipe,
+        'args': args,
+        'runnable': runnable,
+        'reason': reason,
+        'refscan': refscan,
+        'refscan_path': str(refscan_path) if refscan_found else None,
+        'needs_refscan': needs_refscan,
+        'retrospective': retrospective,
+        'sense_factors': to_json(sense_factors),
+        'mixes': to_json(parameter2read.mix),
+        'stacks': to_json(parameter2read.stack),
+        'dynamics': len(parameter2read.dyn),
+        'cardiac_phases': to_json(nr_phases),
+        'flow_segments': len(parameter2read.extr1),
+        'recon_resolution': to_json(pars.get_recon_resolution()),
+        'voxel_sizes': to_json(pars.get_voxel_sizes()),
+    }
+
+
+def update(folder, index_file, workers):
+    index = dict()
+    if Path(index_file).exists():
+        with open(index_file, 'r') as f:
+            index = json.load(f)
+
+    # only parse new or modified scans
+    scans = dict()
+    for scan in find_scans(folder):
+        stat = scan.stat()
+        entry = index.get(str(scan))
+        # (entries of older versions of the index without the recipe arguments are parsed again as well)
+        if entry is None or entry['mtime'] != stat.st_mtime or entry['size'] != stat.st_size or \
+                ('error' not in entry and 'reason' not in entry):
+            scans[str(scan)] = (scan, stat)
+
+    # remove scans which do not exist anymore
+    for key in [key for key in index if key.startswith(str(folder)) and not Path(key).exists()]:
+        del index[key]
+
+    def process(item):
+        key, (scan, stat) = item
+        try:
+            summary = summarize(scan)
+        except Exception as e:
+            summary = {'error': str(e)}
+        return key, {'mtime': stat.st_mtime, 'size': stat.st_size, **summary}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for key, entry in pool.map(process, scans.items()):
+            index[key] = entry
+            status = f'error: {entry["error"]}' if 'error' in entry else entry['type']
+            print(f'{key}: {status}')
+
+    with open(index_file, 'w') as f:
+        json.dump(index, f, indent=1)
+    print(f'{len(scans)} scans updated, {len(index)} scans in the index')
+
+
+def query(index_file, scan_type=None, refscan=None, needs_refscan=None, recipe=None, manifest=None):
+    with open(index_file, 'r') as f:
+        index = json.load(f)
+
+    jobs = []
+    for key, entry in sorted(index.items()):
+        if 'error' in entry:
+            continue
+        if scan_type and entry['type'] != scan_type:
+            continue
+        if refscan and entry['refscan'] != refscan:
+            continue
+        if needs_refscan is not None and entry['needs_refscan'] != needs_refscan:
+            continue
+        if recipe and entry['recipe'] != recipe:
+            continue
+        print(f'{key}: type={entry["type"]}, recipe={entry["recipe"]}, refscan={entry["refscan"]}, '
+              f'resolution={entry["recon_resolution"]}' + ('' if entry['runnable'] else f' ({entry["reason"]})'))
+        if entry['runnable']:
+            jobs.append({'file': key, 'recipe': entry['recipe'], 'args': entry['args']})
+
+    if manifest:
+        # the scans which can be reconstructed as a manifest for batch_recon.py
+        with open(manifest, 'w') as f:
+            for job in jobs:
+                f.write(json.dumps(job) + '\n')
+        print(f'{len(jobs)} jobs written to {manifest}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='scan index')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    update_parser = subparsers.add_parser('update', help='create or update the index')
+    update_parser.add_argument('folder', help='the folder which contains the scans')
+    update_parser.add_argument('--index', default='scan_index.json', help='path to the index file')
+    update_parser.add_argument('--workers', type=int, default=os.cpu_count(), help='the number of parallel threads')
+
+    query_parser = subparsers.add_parser('query', help='query the index')
+    query_parser.add_argument('--index', default='scan_index.json', help='path to the index file')
+    query_parser.add_argument('--type', default=None, choices=['epi', 'flow', 'cardiac', 'normal'], help='the scan type')
+    query_parser.add_argument('--refscan', default=None, help='the name of the SENSE reference scan')
+    query_parser.add_argument('--needs-refscan', action='store_true', default=None, help='only scans which need a SENSE reference scan')
+    query_parser.add_argument('--recipe', default=None, help='the recipe (see batch_recon.py)')
+    query_parser.add_argument('--manifest', default=None, help='write the scans which can be reconstructed into this batch_recon.py manifest')
+    args = parser.parse_args()
+
+    if args.command == 'update':
+        update(Path(args.folder).resolve(), args.index, args.workers)
+    else:
+        query(args.index, scan_type=args.type, refscan=args.refscan, needs_refscan=args.needs_refscan, recipe=args.recipe,
+              manifest=args.manifest)
@@ -0,0 +1,33 @@
+# ----------------------------------------------------------------------------------------
+# sensitivity_maps
+# ----------------------------------------------------------------------------------------
+# Applies a function to the arrays of a sensitivity container (as returned by
+# pr.reformat_refscan), e.g. to upsample, crop or share the maps. The container itself is
+# not changed, a shallow copy with the new arrays is returned. Used by
+# coarse_sensitivities.py, shared_sense_recon.py and roi_recon.py.
+#
+# Usage:
+#
+#   from sensitivity_maps import MAP_ATTRIBUTES, map_sensitivity
+#
+#   sens = pr.reformat_refscan(qbc, coil, ref_pars, pars, stack=stack, mix=mix, match_target_size=True)
+#   cropped = map_sensitivity(sens, lambda value: value[10:20])
+
+import copy
+
+# the attributes of the sensitivity container which contain the maps (the noise covariance matrix psi does not depend
+# on the grid)
+MAP_ATTRIBUTES = ('sensitivity', 'surfacecoil', 'bodycoil')
+
+
+def sensitivity_arrays(sens, attributes=MAP_ATTRIBUTES):
+    """Returns the (name, array) pairs of the given attributes which are set in the sensitivity container."""
+    return [(name, getattr(sens, name)) for name in attributes if getattr(sens, name, None) is not None]
+
+
+def map_sensitivity(sens, fn, attributes=MAP_ATTRIBUTES):
+    """Returns a copy of the sensitivity container where fn is applied to the arrays of the given attributes."""
+    result = copy.copy(sens)
+    for name, value in sensitivity_arrays(sens, attributes):
+        setattr(result, name, fn(value))
+    return result
@@ -0,0 +1,225 @@
+# ----------------------------------------------------------------------------------------
+# shared_sense_recon
+# ----------------------------------------------------------------------------------------
+# A cartesian SENSE reconstruction (see sense_recon.py) which reconstructs the dynamics of
+# every mix and stack in parallel worker processes. The sensitivity maps are computed once
+# per mix and stack and exported into named shared memory. The workers attach to it as
+# read-only numpy views without copying or pickling the maps. The parameters are read only
+# once per worker process (when the worker is started) and not sent with every task.
+#
+# Args:
+#        rawfile (required)              : The path to the Philips rawfile to be reconstructed
+#        refscan (required)              : The path to the Philips SENSE reference scan
+#        output_path (optional)          : The output path where the results are stored
+#        workers (optional)              : The number of worker processes
+#        dynamics-per-task (optional)    : The number of dynamics reconstructed in one task
+#
+# The shared memory is released as soon as all dynamics of a mix and stack are
+# reconstructed (or when an error occurs).
+#
+# Note: only the sensitivities are shared. The parameters (including the labels) cannot be
+# created from shared memory, hence every worker process parses the rawfile parameters
+# itself, which takes the time and the memory of pr.Parameter once per worker.
+#
+# Requires: Python 3.8 or newer (multiprocessing.shared_memory)
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from pathlib import Path
+
+import numpy as np
+from scipy.io import savemat
+
+import precon as pr
+from sensitivity_maps import MAP_ATTRIBUTES, map_sensitivity, sensitivity_arrays
+
+# the attributes of the sensitivity container which are shared
+SHARED_ATTRIBUTES = MAP_ATTRIBUTES + ('psi',)
+
+
+class SharedArrays:
+    """Exports numpy arrays into named shared memory. The memory is released when the context is left."""
+
+    def __init__(self):
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def export(self, array):
+        array = np.asarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        order = 'F' if array.flags.f_contiguous and not array.flags.c_contiguous else 'C'
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf, order=order)
+        view[...] = array
+        self.blocks.append(block)
+        return block.name, array.shape, array.dtype.str, order
+
+    def release(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+def share_sensitivity(sens, shared):
+    # returns a copy of the sensitivity container without the large arrays (cheap to pickle) and the descriptors of the
+    # arrays in shared memory
+    descriptors = {name: shared.export(value) for name, value in sensitivity_arrays(sens, SHARED_ATTRIBUTES)}
+    return map_sensitivity(sens, lambda value: None, SHARED_ATTRIBUTES), descriptors
+
+
+# the state of a worker process
+worker_pars = None
+worker_blocks = dict()
+
+
+def attach(descriptor):
+    name, shape, dtype, order = descriptor
+    if name not in worker_blocks:
+        try:
+            # the shared memory is owned (and unlinked) by the main process
+            worker_blocks[name] = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # python < 3.13 registers the attached memory with the resource tracker, which unlinks it when the worker
+            # exits. Unregistering it afterwards would also remove the registration of the main process (the workers
+            # share its resource tracker), hence the registration is skipped while attaching.
+            register = resource_tracker.register
+            resource_tracker.register = lambda *args: None
+            try:
+                worker_blocks[name] = shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+    view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=worker_blocks[name].buf, order=order)
+    view.flags.writeable = False
+    return view
+
+
+def detach(names):
+    for name in list(worker_blocks):
+        if name not in names:
+            worker_blocks.pop(name).close()
+
+
+def init_worker(rawfile):
+    global worker_pars
+    worker_pars = pr.Parameter(Path(rawfile))
+
+
+def reconstruct_dynamics(mix, stack, dynamics, sens, descriptors):
+    pars = worker_pars
+
+    # attach the sensitivities (zero-copy) and release the ones of previous stacks
+    detach({d[0] for d in descriptors.values()})
+    for name, descriptor in descriptors.items():
+        setattr(sens, name, attach(descriptor))
+
+    parameter2read = pr.Parameter2Read(pars.labels)
+    parameter2read.mix = mix
+    parameter2read.stack = stack
+    parameter2read.dyn = dynamics
+
+    # read data
+    with open(pars.rawfile, 'rb') as raw:
+        data, labels = pr.read(raw, parameter2read, pars.labels, pars.coil_info)
+
+    # sort and zero fill data (create k-space)
+    res_before_sense = pars.get_recon_resolution(mix=mix, xovs=False, yovs=True, zovs=True, folded=True)
+    data, labels = pr.sort(data, labels, output_size=res_before_sense)
+
+    # ringing filter
+    sampled_size = (pars.get_sampled_size(enc=0, stack=stack, ovs=False), pars.get_sampled_size(enc=1, stack=stack),
+                    pars.get_sampled_size(enc=2, stack=stack))
+    data = pr.hamming_filter(data, (0.25, 0.25, 0.25), axis=(0, 1, 2), sampled_size=sampled_size)
+
+    # FFT
+    data = pr.k2i(data, axis=(0, 1, 2))
+
+    # shift data in image space
+    yshift = pars.get_shift(enc=1, mix=mix, stack=stack)
+    zshift = pars.get_shift(enc=2, mix=mix, stack=stack)
+    if yshift:
+        data = np.roll(data, yshift, axis=1)
+    if zshift:
+        data = np.roll(data, zshift, axis=2)
+
+    # SENSE unfolding
+    regularization_factor = pars.get_value(pars.SENSE_REGULARIZATION_FACTOR, at=0, default=2)
+    output_size = pars.get_recon_resolution(mix=mix, xovs=False, yovs=True, zovs=True, folded=False)
+    data = pr.sense_unfold(data, sens, output_size, regularization_factor=regularization_factor)
+
+    # partial fourier reconstruction
+    kx_range = pars.get_range(enc=0, mix=mix, stack=stack, ovs=False)
+    ky_range = pars.get_range(enc=1, mix=mix, stack=stack)
+    kz_range = pars.get_range(enc=2, mix=mix, stack=stack)
+    if pr.is_partial_fourier(kx_range) or pr.is_partial_fourier(ky_range) or pr.is_partial_fourier(kz_range):
+        data = pr.homodyne(data, kx_range, ky_range, kz_range)
+
+    # perform geometry correction
+    r, gys, gxc, gz = pars.get_geo_corr_pars()
+    locations = pr.utils.get_unique(labels, 'loca')
+    MPS_to_XYZ = pars.get_transformation_matrix(loca=locations, mix=mix, target=pr.Enums.XYZ)
+    voxel_sizes = pars.get_voxel_sizes(mix=mix)
+    data = pr.geo_corr(data, MPS_to_XYZ, r, gys, gxc, gz, voxel_sizes=voxel_sizes)
+
+    # remove the oversampling
+    yovs = pars.get_oversampling(enc=1, mix=mix)
+    zovs = pars.get_oversampling(enc=2, mix=mix)
+    data = pr.crop(data, axis=(1, 2), factor=(yovs, zovs), where='symmetric')
+
+    # transform the images into the radiological convention
+    data = pr.format(data, pars.get_in_plane_transformation(mix=mix, stack=stack))
+
+    # make the image square
+    res = max(data.shape[0], data.shape[1])
+    return pr.zeropad(data, (res, res), axis=(0, 1))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='shared memory sense recon')
+    parser.add_argument('rawfile', help='path to the raw or lab file')
+    parser.add_argument('refscan', help='path to the sense reference scan')
+    parser.add_argument('--output-path', default='./', help='path where the output is saved')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='the number of worker processes')
+    parser.add_argument('--dynamics-per-task', type=int, default=1, help='the number of dynamics per task')
+    args = parser.parse_args()
+
+    # read parameter
+    pars = pr.Parameter(Path(args.rawfile))
+
+    # reconstruct refscan
+    ref_pars = pr.Parameter(Path(args.refscan))
+    qbc, coil = pr.reconstruct_refscan(ref_pars)
+
+    # define what to read
+    parameter2read = pr.Parameter2Read(pars.labels)
+    dynamics = list(parameter2read.dyn)
+
+    # open the matlab file such that the results can be appended as soon as a mix and stack is reconstructed
+    with open(Path(args.output_path) / 'data.mat', 'wb') as mat_file:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(args.rawfile,)) as pool:
+            # reconstruct every mix and stack seperately
+            for mix in parameter2read.mix:
+                for stack in parameter2read.stack:
+                    # calculate the sensitivities
+                    sens = pr.reformat_refscan(qbc, coil, ref_pars, pars, stack=stack, mix=mix, match_target_size=True)
+
+                    # export the sensitivities into shared memory and reconstruct the dynamics in parallel
+                    with SharedArrays() as shared:
+                        shell, descriptors = share_sensitivity(sens, shared)
+                        futures = [pool.submit(reconstruct_dynamics, mix, stack, dynamics[i:i + args.dynamics_per_task], shell, descriptors)
+                                   for i in range(0, len(dynamics), args.dynamics_per_task)]
+                        data = np.concatenate([future.result() for future in futures], axis=pr.Enums.DYN_DIM)
+
+                    # append data and sensitivities to the .mat file
+                    savemat(mat_file, {
+                        f'data_{mix}_{stack}': data,
+                        f'sensitivity_{mix}_{stack}': sens.sensitivity,
+                        f'coil_ref_{mix}_{stack}': sens.surfacecoil,
+                        f'body_ref{mix}_{stack}': sens.bodycoil,
+                    })
@@ -47,74 +47,71 @@ parameter2read = pr.Parameter2Read(pars.labels)
 # enable performance logging (reconstruction times)
 pars.performance_logging = True
 
-# dictionary for matlab export
-mdic = dict()
-
-# reconstruct every mix and stack seperately
-for mix in parameter2read.mix:
-    for stack in parameter2read.stack:
-        parameter2read.stack = stack
-        parameter2read.mix = mix
-
-        # read data
-        with open(pars.rawfile, "rb") as raw:
-            data, labels = pr.read(raw, parameter2read, pars.labels, pars.coil_info)
-
-        # sort and zero fill data (create k-space)
-        cur_recon_resolution = pars.get_recon_resolution(mix=mix, xovs=False, yovs=True, zovs=True)
-        data, labels = pr.sort(data, labels, output_size=cur_recon_resolution)
-
-        # FFT
-        data = pr.k2i(data, axis=(0, 1, 2))
-
-        # shift data in image space
-        yshift = pars.get_shift(enc=1, mix=mix, stack=stack)
-        zshift = pars.get_shift(enc=2, mix=mix, stack=stack)
-        if yshift:
-            data = np.roll(data, yshift, axis=1)
-        if zshift:
-            data = np.roll(data, zshift, axis=2)
-
-        # partial fourier reconstruction
-        kx_range = pars.get_range(enc=0, mix=mix, stack=stack, ovs=False)
-        ky_range = pars.get_range(enc=1, mix=mix, stack=stack)
-        kz_range = pars.get_range(enc=2, mix=mix, stack=stack)
-        if pr.is_partial_fourier(kx_range) or pr.is_partial_fourier(ky_range) or pr.is_partial_fourier(kz_range):
-            data = pr.homodyne(data, kx_range, ky_range, kz_range)
-
-        # combine coils with a sum-of squares combination
-        data = pr.sos(data, axis=3)
-
-        # perform geometry correction
-        r, gys, gxc, gz = pars.get_geo_corr_pars()
-        locations = pr.utils.get_unique(labels, "loca")
-        MPS_to_XYZ = pars.get_transformation_matrix(loca=locations, mix=mix, target=pr.Enums.XYZ)
-        voxel_sizes = pars.get_voxel_sizes(mix=mix)
-        data = pr.geo_corr(data, MPS_to_XYZ, r, gys, gxc, gz, voxel_sizes=voxel_sizes)
-
-        # remove the oversampling
-        yovs = pars.get_oversampling(enc=1, mix=mix)
-        zovs = pars.get_oversampling(enc=2, mix=mix)
-        data = pr.crop(data, axis=(1, 2), factor=(yovs, zovs), where="symmetric")
-
-        # transform the images into the radiological convention
-        data = pr.format(data, pars.get_in_plane_transformation(mix=mix, stack=stack))
-
-        # make the image square
-        res = max(data.shape[0], data.shape[1])
-        data = pr.zeropad(data, (res, res), axis=(0, 1))
-
-        # save data in .mat format
-        mdic[f"data_{mix}_{stack}"] = data
-
-        # export the data as par/rec
-        scaling = pr.Recfile.get_scaling(data, types=(pr.Enums.REC_IMAGE_TYPE_M,))
-        rec = pr.Recfile(data, types=(pr.Enums.REC_IMAGE_TYPE_M,), scaling=scaling)
-        savemat(Path(args.output_path) / "rec.mat", {'rec': rec})
-        par = pr.Parfile(pars, data, labels, types=(pr.Enums.REC_IMAGE_TYPE_M,), scaling=scaling)
-        filename_par = Path(args.output_path) / f'{pars.rawfile.stem}_{mix}_{stack}.par'
-        filename_rec = Path(args.output_path) / f'{pars.rawfile.stem}_{mix}_{stack}.rec'
-        par.write(filename_par)
-        rec.write(filename_rec)
-
-savemat(Path(args.output_path) / "data.mat", mdic)
+# open the matlab file such that the results can be appended as soon as a mix and stack is reconstructed
+with open(Path(args.output_path) / "data.mat", "wb") as mat_file:
+    # reconstruct every mix and stack seperately
+    for mix in parameter2read.mix:
+        for stack in parameter2read.stack:
+            parameter2read.stack = stack
+            parameter2read.mix = mix
+
+            # read data
+            with open(pars.rawfile, "rb") as raw:
+                data, labels = pr.read(raw, parameter2read, pars.labels, pars.coil_info)
+
+            # sort and zero fill data (create k-space)
+            cur_recon_resolution = pars.get_recon_resolution(mix=mix, xovs=False, yovs=True, zovs=True)
+            data, labels = pr.sort(data, labels, output_size=cur_recon_resolution)
+
+            # FFT
+            data = pr.k2i(data, axis=(0, 1, 2))
+
+            # shift data in image space
+            yshift = pars.get_shift(enc=1, mix=mix, stack=stack)
+            zshift = pars.get_shift(enc=2, mix=mix, stack=stack)
+            if yshift:
+                data = np.roll(data, yshift, axis=1)
+            if zshift:
+                data = np.roll(data, zshift, axis=2)
+
+            # partial fourier reconstruction
+            kx_range = pars.get_range(enc=0, mix=mix, stack=stack, ovs=False)
+            ky_range = pars.get_range(enc=1, mix=mix, stack=stack)
+            kz_range = pars.get_range(enc=2, mix=mix, stack=stack)
+            if pr.is_partial_fourier(kx_range) or pr.is_partial_fourier(ky_range) or pr.is_partial_fourier(kz_range):
+                data = pr.homodyne(data, kx_range, ky_range, kz_range)
+
+            # combine coils with a sum-of squares combination
+            data = pr.sos(data, axis=3)
+
+            # perform geometry correction
+            r, gys, gxc, gz = pars.get_geo_corr_pars()
+            locations = pr.utils.get_unique(labels, "loca")
+            MPS_to_XYZ = pars.get_transformation_matrix(loca=locations, mix=mix, target=pr.Enums.XYZ)
+            voxel_sizes = pars.get_voxel_sizes(mix=mix)
+            data = pr.geo_corr(data, MPS_to_XYZ, r, gys, gxc, gz, voxel_sizes=voxel_sizes)
+
+            # remove the oversampling
+            yovs = pars.get_oversampling(enc=1, mix=mix)
+            zovs = pars.get_oversampling(enc=2, mix=mix)
+            data = pr.crop(data, axis=(1, 2), factor=(yovs, zovs), where="symmetric")
+
+            # transform the images into the radiological convention
+            data = pr.format(data, pars.get_in_plane_transformation(mix=mix, stack=stack))
+
+            # make the image square
+            res = max(data.shape[0], data.shape[1])
+            data = pr.zeropad(data, (res, res), axis=(0, 1))
+
+            # append data to the .mat file
+            savemat(mat_file, {f"data_{mix}_{stack}": data})
+
+            # export the data as par/rec
+            scaling = pr.Recfile.get_scaling(data, types=(pr.Enums.REC_IMAGE_TYPE_M,))
+            rec = pr.Recfile(data, types=(pr.Enums.REC_IMAGE_TYPE_M,), scaling=scaling)
+            savemat(Path(args.output_path) / "rec.mat", {'rec': rec})
+            par = pr.Parfile(pars, data, labels, types=(pr.Enums.REC_IMAGE_TYPE_M,), scaling=scaling)
+            filename_par = Path(args.output_path) / f'{pars.rawfile.stem}_{mix}_{stack}.par'
+            filename_rec = Path(args.output_path) / f'{pars.rawfile.stem}_{mix}_{stack}.rec'
+            par.write(filename_par)
+            rec.write(filename_rec)
@@ -0,0 +1,46 @@
+# ----------------------------------------------------------------------------------------
+# spectro_averaging
+# ----------------------------------------------------------------------------------------
+# Reads spectroscopy data one average after the other and accumulates the averages in a
+# running sum (used by spectro_sv_recon.py and spectro_csi_recon.py). Only one average is
+# held in memory in addition to the sum, which reduces the memory by the number of
+# averages compared to reading all averages at once.
+#
+# Usage:
+#
+#   from spectro_averaging import read_averaged
+#
+#   data, labels = read_averaged(pars, parameter2read)
+#
+# The result corresponds to pr.read followed by pr.sort with immediate_averaging.
+
+import numpy as np
+
+import precon as pr
+
+
+def read_averaged(pars, parameter2read):
+    # reads and sorts one average after the other and accumulates it in a running sum with a count for every profile.
+    # hence, only one average is held in memory (in addition to the sum) instead of all averages.
+    averages = list(parameter2read.aver)
+
+    total = None
+    with open(pars.rawfile, 'rb') as raw:
+        for aver in averages:
+            parameter2read.aver = aver
+            data, labels = pr.read(raw, parameter2read, pars.labels, pars.coil_info, oversampling_removal=False)
+            data, labels = pr.sort(data, labels, immediate_averaging=True, zeropad=(False, False, False))
+
+            # profiles which were not acquired in the current average are zero and not counted
+            acquired = np.any(data != 0, axis=0, keepdims=True)
+            if total is None:
+                total = data
+                counts = acquired.astype(np.float32)
+            elif total.shape != data.shape:
+                raise ValueError(f'the average {aver} has a different size: {data.shape} (expected {total.shape})')
+            else:
+                total += data
+                counts += acquired
+
+    parameter2read.aver = averages
+    return total / np.maximum(counts, 1), labels
@@ -0,0 +1,95 @@
+# ----------------------------------------------------------------------------------------
+# spectro_csi_recon
+# ----------------------------------------------------------------------------------------
+# A reconstruction for multi-voxel spectroscopy (CSI) data. In contrast to spectro_sv_recon.py
+# the coil combination is performed for all voxels at once in a vectorized way instead of
+# voxel by voxel.
+#
+# Args:
+#        rawfile (required)            : The path to the Philips rawfile to be reconstructed
+#        output_path (optional)        : The output path where the results are stored
+#        streaming-averaging (optional): When given, the averages are read one after the other and accumulated in a
+#                                        running sum, which reduces the memory by the number of averages
+#
+# The reconstruction performed in this file consists of the following steps:
+#
+#   1. Read the parameters from the rawfile
+#   2. Read the data of the first mix and stack without oversampling removal
+#   3. Sort the data and average it (or read, sort and accumulate the averages one after the other)
+#   4. Remove the oversampling along the spectral dimension
+#   5. Perform fourier transformation along the spatial dimensions
+#   6. Combine the coils with a batched SVD combination (all voxels at once)
+#   7. Perform fourier transformation along the spectral dimension
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+from scipy.io import savemat
+
+import precon as pr
+from spectro_averaging import read_averaged
+
+
+def combine_coils(data, time_axis=0, coil_axis=3):
+    # SVD coil combination for all voxels at once. The first right singular vector of the (time x coils) matrix of a
+    # voxel is the dominant eigenvector of the coil covariance matrix, which is much smaller than the matrix itself.
+    # Hence, the covariance matrices of all voxels are computed with a batched matrix product and decomposed with a
+    # batched eigenvalue decomposition.
+    fids = np.moveaxis(data, (time_axis, coil_axis), (-2, -1))
+    covariance = np.swapaxes(fids.conj(), -1, -2) @ fids
+    _, eigenvectors = np.linalg.eigh(covariance)
+    weights = eigenvectors[..., :, -1:]
+    combined = (fids @ weights)[..., 0]
+
+    # remove the arbitrary phase of the singular vector such that the first point of the fid is real
+    combined *= np.exp(-1j * np.angle(combined[..., :1]))
+
+    combined = np.moveaxis(combined, -1, time_axis)
+    return np.expand_dims(combined, coil_axis).astype(data.dtype, copy=False)
+
+
+parser = argparse.ArgumentParser(description='csi recon')
+parser.add_argument('rawfile', help='path to the raw or lab file')
+parser.add_argument('--output-path', default='./', help='path where the output is saved')
+parser.add_argument('--streaming-averaging', action='store_true', help='accumulate the averages while reading')
+args = parser.parse_args()
+
+# read parameter
+pars = pr.Parameter(Path(args.rawfile))
+
+# define what to read
+parameter2read = pr.Parameter2Read(pars.labels)
+
+# enable performance logging (reconstruction times)
+pars.performance_logging = True
+
+# reconstruct the first mix and stack
+parameter2read.stack = 0
+parameter2read.mix = 0
+
+# read, sort and average the data
+if args.streaming_averaging:
+    data, labels = read_averaged(pars, parameter2read)
+else:
+    with open(pars.rawfile, 'rb') as raw:
+        data, labels = pr.read(raw, parameter2read, pars.labels, pars.coil_info, oversampling_removal=False)
+
+    data, labels = pr.sort(data, labels, immediate_averaging=True, zeropad=(False, False, False))
+
+# determine the oversampling factor and remove oversampling
+cur_recon_resolution = pars.get_recon_resolution()
+xovs = pr.get_data_size(data)[pr.Enums.X_DIM] / cur_recon_resolution[pr.Enums.X_DIM]
+data = pr.spectro_downsample(data, xovs)
+
+# FFT along the spatial dimensions
+data = pr.k2i(data, axis=(1, 2))
+
+# combine coils with a svd combination (all voxels at once)
+data = combine_coils(data, time_axis=pr.Enums.X_DIM, coil_axis=pr.Enums.CHANNEL_DIM)
+
+# FFT along the spectral dimension
+data = pr.k2i(data, axis=0)
+
+# save data in .mat format
+savemat(Path(args.output_path) / 'data.mat', {'data': data})
@@ -4,8 +4,10 @@
 # A simple reconstruction for single-voxel spectroscopy data
 #
 # Args:
-#        rawfile (required)    : The path to the Philips rawfile to be reconstructed
-#        output_path (optional): The output path where the results are stored
+#        rawfile (required)            : The path to the Philips rawfile to be reconstructed
+#        output_path (optional)        : The output path where the results are stored
+#        streaming-averaging (optional): When given, the averages are read one after the other and accumulated in a
+#                                        running sum, which reduces the memory by the number of averages
 
 import argparse
 from pathlib import Path
@@ -13,12 +15,16 @@ from pathlib import Path
 from scipy.io import savemat
 
 import precon as pr
+from spectro_averaging import read_averaged
 
 parser = argparse.ArgumentParser(description="normal recon")
 parser.add_argument("rawfile", help="path to the raw or lab file")
 parser.add_argument(
     "--output-path", default="./", help="path where the output is saved"
 )
+parser.add_argument(
+    "--streaming-averaging", action="store_true", help="accumulate the averages while reading"
+)
 args = parser.parse_args()
 
 # read parameter
@@ -37,11 +43,14 @@ mdic = dict()
 parameter2read.stack = 0
 parameter2read.mix = 0
 
-# read data
-with open(pars.rawfile, "rb") as raw:
-    data, labels = pr.read(raw, parameter2read, pars.labels, pars.coil_info, oversampling_removal=False)
+# read, sort and average the data
+if args.streaming_averaging:
+    data, labels = read_averaged(pars, parameter2read)
+else:
+    with open(pars.rawfile, "rb") as raw:
+        data, labels = pr.read(raw, parameter2read, pars.labels, pars.coil_info, oversampling_removal=False)
 
-data, labels = pr.sort(data, labels, immediate_averaging=True, zeropad=(False, False, False))
+    data, labels = pr.sort(data, labels, immediate_averaging=True, zeropad=(False, False, False))
 
 # determine the oversampling factor and remove oversampling
 cur_recon_resolution = pars.get_recon_resolution()
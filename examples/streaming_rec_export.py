@@ -0,0 +1,179 @@
+# ----------------------------------------------------------------------------------------
+# streaming_rec_export
+# ----------------------------------------------------------------------------------------
+# A simple cartesian reconstruction (see simple_recon.py) which reconstructs every mix and
+# stack dynamic by dynamic and exports the result as par/rec. The reconstructed images are
+# written into a memory mapped file and the rec scaling is computed with an accumulator which
+# is updated after every dynamic. Hence, only one dynamic is held in memory during the
+# reconstruction.
+#
+# Limitations:
+#   - the par/rec export is not streamed: pr.Recfile and pr.Parfile are created from the whole
+#     (memory mapped) series and the quantized rec is created in one piece.
+#   - the accumulator derives the scaling from the minimum and maximum of the series. This is
+#     only identical to pr.Recfile.get_scaling(series) if the rec scaling is a linear mapping
+#     of the value range, which has not been verified for all image types.
+#
+# Args:
+#        rawfile (required)    : The path to the Philips rawfile to be reconstructed
+#        output_path (optional): The output path where the results are stored
+#
+# The reconstruction performed in this file consists of the following steps:
+#
+#   1. Read the parameters from the rawfile
+#   2. Create a Parameter2Read class from the labels which defines what data to read
+#   3. Loop over all mixes, stacks and dynamics
+#   4. Reconstruct the current dynamic (same steps as in simple_recon.py)
+#   5. Remove the oversampling, format and zero pad the images directly into the memory mapped file (see output_format.py)
+#   6. Update the scaling statistics
+#   7. Compute the rec scaling from the accumulated statistics and export the series as par/rec
+
+import argparse
+import os
+from pathlib import Path
+
+import numpy as np
+
+import precon as pr
+from output_format import OutputFormatter
+
+
+class ScalingAccumulator:
+    """Accumulates the rec scaling statistics chunk by chunk (e.g. dynamic by dynamic or slice by slice).
+
+    Only the minimum and maximum are accumulated, i.e. a linear mapping of the value range onto the rec range is assumed.
+    """
+
+    def __init__(self, types=(pr.Enums.REC_IMAGE_TYPE_M,)):
+        self.types = types
+        self.min = None
+        self.max = None
+        self.dtype = None
+        self.ndim = None
+
+    def update(self, chunk):
+        if np.iscomplexobj(chunk):
+            raise ValueError('the scaling accumulator only supports real valued (magnitude) images')
+        cur_min = np.min(chunk)
+        cur_max = np.max(chunk)
+        self.min = cur_min if self.min is None else min(self.min, cur_min)
+        self.max = cur_max if self.max is None else max(self.max, cur_max)
+        self.dtype = chunk.dtype
+        self.ndim = chunk.ndim
+
+    def get_scaling(self):
+        if self.min is None:
+            raise RuntimeError('no data has been added to the scaling accumulator')
+        # assuming that the rec scaling is a linear mapping of the value range onto the integer range of the rec file, it
+        # only depends on the extrema and an array which contains the minimum and maximum yields the scaling of the whole
+        # series.
+        extrema = np.zeros((2,) + (1,) * (self.ndim - 1), dtype=self.dtype)
+        extrema[0] = self.min
+        extrema[1] = self.max
+        return pr.Recfile.get_scaling(extrema, types=self.types)
+
+
+parser = argparse.ArgumentParser(description='streaming par/rec export')
+parser.add_argument('rawfile', help='path to the raw or lab file')
+parser.add_argument('--output-path', default='./', help='path where the output is saved')
+args = parser.parse_args()
+
+# read parameter
+pars = pr.Parameter(Path(args.rawfile))
+
+# define what to read
+parameter2read = pr.Parameter2Read(pars.labels)
+dynamics = parameter2read.dyn
+
+# enable performance logging (reconstruction times)
+pars.performance_logging = True
+
+types = (pr.Enums.REC_IMAGE_TYPE_M,)
+
+# reconstruct every mix and stack seperately
+for mix in parameter2read.mix:
+    for stack in parameter2read.stack:
+        parameter2read.stack = stack
+        parameter2read.mix = mix
+
+        # removes the oversampling, transforms into the radiological convention and makes the images square in one pass
+        yovs = pars.get_oversampling(enc=1, mix=mix)
+        zovs = pars.get_oversampling(enc=2, mix=mix)
+        formatter = OutputFormatter(yovs, zovs, pars.get_in_plane_transformation(mix=mix, stack=stack))
+
+        scaling_accumulator = ScalingAccumulator(types=types)
+        series_labels = []
+        series = None
+        filename_series = Path(args.output_path) / f'{pars.rawfile.stem}_{mix}_{stack}.npy'
+
+        # reconstruct every dynamic separately
+        for i, dyn in enumerate(dynamics):
+            parameter2read.dyn = dyn
+
+            # read data
+            with open(pars.rawfile, 'rb') as raw:
+                data, labels = pr.read(raw, parameter2read, pars.labels, pars.coil_info)
+
+            # sort and zero fill data (create k-space)
+            cur_recon_resolution = pars.get_recon_resolution(mix=mix, xovs=False, yovs=True, zovs=True)
+            data, labels = pr.sort(data, labels, output_size=cur_recon_resolution)
+
+            # FFT
+            data = pr.k2i(data, axis=(0, 1, 2))
+
+            # shift data in image space
+            yshift = pars.get_shift(enc=1, mix=mix, stack=stack)
+            zshift = pars.get_shift(enc=2, mix=mix, stack=stack)
+            if yshift:
+                data = np.roll(data, yshift, axis=1)
+            if zshift:
+                data = np.roll(data, zshift, axis=2)
+
+            # partial fourier reconstruction
+            kx_range = pars.get_range(enc=0, mix=mix, stack=stack, ovs=False)
+            ky_range = pars.get_range(enc=1, mix=mix, stack=stack)
+            kz_range = pars.get_range(enc=2, mix=mix, stack=stack)
+            if pr.is_partial_fourier(kx_range) or pr.is_partial_fourier(ky_range) or pr.is_partial_fourier(kz_range):
+                data = pr.homodyne(data, kx_range, ky_range, kz_range)
+
+            # combine coils with a sum-of squares combination
+            data = pr.sos(data, axis=3)
+
+            # perform geometry correction
+            r, gys, gxc, gz = pars.get_geo_corr_pars()
+            locations = pr.utils.get_unique(labels, 'loca')
+            MPS_to_XYZ = pars.get_transformation_matrix(loca=locations, mix=mix, target=pr.Enums.XYZ)
+            voxel_sizes = pars.get_voxel_sizes(mix=mix)
+            data = pr.geo_corr(data, MPS_to_XYZ, r, gys, gxc, gz, voxel_sizes=voxel_sizes)
+
+            # create the memory mapped series once the image size is known
+            if series is None:
+                series_size = list(formatter.output_shape(data.shape))
+                series_size[pr.Enums.DYN_DIM] = len(dynamics)
+                series = np.lib.format.open_memmap(filename_series, mode='w+', dtype=data.dtype, shape=tuple(series_size))
+
+            # remove the oversampling, transform the images into the radiological convention and make them square (the
+            # images are written directly into the series)
+            index = [slice(None)] * series.ndim
+            index[pr.Enums.DYN_DIM] = slice(i, i + 1)
+            data = formatter.apply(data, out=series[tuple(index)])
+
+            # update the scaling statistics
+            scaling_accumulator.update(data)
+            series_labels += list(labels)
+
+        # export the data as par/rec (the rec is created from the whole series)
+        series.flush()
+        scaling = scaling_accumulator.get_scaling()
+        rec = pr.Recfile(series, types=types, scaling=scaling)
+        par = pr.Parfile(pars, series, series_labels, types=types, scaling=scaling)
+        filename_par = Path(args.output_path) / f'{pars.rawfile.stem}_{mix}_{stack}.par'
+        filename_rec = Path(args.output_path) / f'{pars.rawfile.stem}_{mix}_{stack}.rec'
+        par.write(filename_par)
+        rec.write(filename_rec)
+
+        # remove the memory mapped series
+        del rec, par, series
+        os.remove(filename_series)
+
+        parameter2read.dyn = dynamics
@@ -0,0 +1,149 @@
+# ----------------------------------------------------------------------------------------
+# thread_limits
+# ----------------------------------------------------------------------------------------
+# Configures the number of threads of all backends used in a reconstruction: the BLAS and
+# OpenMP thread pools of numpy/scipy (through threadpoolctl), the scipy FFT workers and the
+# intra-op threads of torch (used e.g. by pr.sense_unfold(..., use_torch=True)). When
+# several reconstructions run on the same machine (e.g. in batch_recon.py) each of these
+# thread pools uses all cores by default, which oversubscribes the cores badly.
+#
+# Args:
+#        script (optional)   : The reconstruction script to run (e.g. sense_recon.py)
+#        threads (optional)  : The number of threads of every backend
+#        processes (optional): The number of processes which share the machine. Every process
+#                              gets an equal share of the cores (ignored when threads is given)
+#        report (optional)   : When given, the effective thread counts are printed
+#        script_args         : All remaining arguments are passed to the script
+#
+# Example:
+#
+#   python thread_limits.py --threads 4 --report sense_recon.py my_rawfile.raw my_refscan.raw
+#
+# The limits can also be set from within a script, either for the rest of the process or
+# for a block of code:
+#
+#   from thread_limits import num_threads, set_num_threads, process_budget
+#   set_num_threads(process_budget(4))
+#   with num_threads(1):
+#       ...
+#
+# Note: threadpoolctl and torch are optional. The threads of torch are only set when torch is
+# already imported, otherwise torch takes them from the environment when it is imported. The
+# scipy FFT workers are set for the calling thread only.
+
+import argparse
+import os
+import runpy
+import sys
+from contextlib import ExitStack, contextmanager
+
+# the environment variables which are read by the thread pools when they are loaded (also in child processes)
+ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+# the limits set with set_num_threads
+_global_limits = None
+
+
+def _torch():
+    # torch is optional and only configured when it has already been imported (importing torch only to configure it
+    # would be expensive). When torch is imported later, it reads the number of threads from OMP_NUM_THREADS.
+    return sys.modules.get('torch')
+
+
+def _restore_env(env):
+    for key, value in env.items():
+        if value is None:
+            os.environ.pop(key, None)
+        else:
+            os.environ[key] = value
+
+
+def available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def process_budget(processes):
+    """Returns the number of threads per process when the available cores are shared by the given number of processes."""
+    return max(1, available_cpus() // max(1, processes))
+
+
+@contextmanager
+def num_threads(n):
+    """Limits the threads of all backends to n within the context."""
+    n = max(1, int(n))
+    with ExitStack() as stack:
+        stack.callback(_restore_env, {key: os.environ.get(key) for key in ENV_VARS})
+        os.environ.update({key: str(n) for key in ENV_VARS})
+
+        try:
+            from threadpoolctl import threadpool_limits
+            stack.enter_context(threadpool_limits(limits=n))
+        except ImportError:
+            pass
+
+        import scipy.fft
+        stack.enter_context(scipy.fft.set_workers(n))
+
+        torch = _torch()
+        if torch is not None:
+            stack.callback(torch.set_num_threads, torch.get_num_threads())
+            torch.set_num_threads(n)
+
+        yield
+
+
+def set_num_threads(n):
+    """Limits the threads of all backends for the rest of the process. Use n=None to restore the defaults."""
+    global _global_limits
+    if _global_limits is not None:
+        _global_limits.__exit__(None, None, None)
+        _global_limits = None
+    if n is not None:
+        _global_limits = num_threads(n)
+        _global_limits.__enter__()
+
+
+def thread_info():
+    """Returns the effective number of threads of every backend."""
+    import scipy.fft
+
+    info = {'cpus': available_cpus(), 'scipy.fft': scipy.fft.get_workers()}
+    try:
+        from threadpoolctl import threadpool_info
+        for pool in threadpool_info():
+            info[f'{pool["internal_api"]} ({pool["prefix"]})'] = pool['num_threads']
+    except ImportError:
+        info['blas/openmp'] = 'unknown (threadpoolctl not installed)'
+
+    torch = _torch()
+    if torch is not None:
+        info['torch'] = torch.get_num_threads()
+    return info
+
+
+def print_thread_info():
+    for name, threads in thread_info().items():
+        print(f'{name:<30}: {threads}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='run a recon with limited threads')
+    parser.add_argument('--threads', type=int, default=None, help='the number of threads of every backend')
+    parser.add_argument('--processes', type=int, default=1, help='the number of processes which share the machine')
+    parser.add_argument('--report', action='store_true', help='print the effective thread counts')
+    parser.add_argument('script', nargs='?', default=None, help='the reconstruction script')
+    parser.add_argument('script_args', nargs=argparse.REMAINDER, help='the arguments passed to the script')
+    args = parser.parse_args()
+
+    # import precon first such that the thread pools of all its dependencies are loaded
+    import precon  # noqa: F401
+
+    set_num_threads(args.threads or process_budget(args.processes))
+    if args.report:
+        print_thread_info()
+
+    if args.script:
+        sys.argv = [args.script] + args.script_args
+        runpy.run_path(args.script, run_name='__main__')